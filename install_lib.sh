@@ -8,4 +8,6 @@ pip install matplotlib
 # then install opencv-contrib-python
 pip install opencv-contrib-python
 pip install higra
+# optional, compiled union-find kernels
+pip install numba
 pip install -U sphinx
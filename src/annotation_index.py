@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`annotation_index` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Annotation Index Module
+
+The groundtruth XML files of the dataset are parsed once into columnar .npy files
+(sorted image ids, sorted categories, int16 boxes grouped by image and category, offsets
+of each group), read back by memory mapping to get the groundtruths of an image without any XML parsing
+
+"""
+
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+class AnnotationIndex:
+    """
+    Create an AnnotationIndex object to look up the groundtruth boxes of an image
+    for a category from an index directory (cf. build_annotation_index)
+    """
+    def __init__(self, index_dir: str):
+        """
+        Create an AnnotationIndex object to look up the groundtruth boxes of an image
+        for a category from an index directory (cf. build_annotation_index)
+
+        :param index_dir: directory of the index files
+        :type index_dir: str
+        :build: an AnnotationIndex with memory mapped boxes and offsets
+        """
+        self.index_dir = index_dir
+        self.image_ids = np.load(os.path.join(index_dir, "image_ids.npy"))
+        self.categories = np.load(os.path.join(index_dir, "categories.npy"))
+        self.boxes = np.load(os.path.join(index_dir, "boxes.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode="r")
+
+        self._image_row = {image_id: i for i, image_id in enumerate(self.image_ids.astype(str).tolist())}
+        self._category_row = {category: i for i, category in enumerate(self.categories.astype(str).tolist())}
+
+    def __len__(self) -> int:
+        """
+        Return the number of indexed images
+
+        :return: number of images
+        :rtype: int
+        """
+        return self.image_ids.shape[0]
+
+    def __contains__(self, image_id: str) -> bool:
+        """
+        Return True if the given image is indexed
+
+        :param image_id: id of the image (name of the file without extension)
+        :type image_id: str
+
+        :return: True if the image is indexed
+        :rtype: bool
+        """
+        return image_id in self._image_row
+
+    def lookup(self, image_id: str, category: str) -> np.ndarray:
+        """
+        Return the groundtruth boxes of the given category in the given image,
+        in the order of the XML file
+
+        :param image_id: id of the image (name of the file without extension)
+        :param category: category of objects to detect
+        :type image_id: str
+        :type category: str
+
+        :return: xmin, ymin, xmax, ymax of each groundtruth, empty if the category is not in the index
+        :rtype: numpy.ndarray of int16 of shape (g,4)
+
+        :UC: image_id in self
+        """
+        image = self._image_row[image_id]
+        category = self._category_row.get(category)
+        if category is None:
+            return self.boxes[:0]
+
+        group = image * self.categories.shape[0] + category
+        return self.boxes[self.offsets[group]:self.offsets[group + 1]]
+
+def build_annotation_index(annotations_dir: str, index_dir: str) -> AnnotationIndex:
+    """
+    Walk the given annotations directory once, parse every XML file (an image annotated in several
+    category directories is parsed once) and write the index files in the given directory :
+    image_ids.npy, categories.npy, boxes.npy (int16 boxes sorted by image and category)
+    and offsets.npy (start of the boxes of each image and category)
+
+    :param annotations_dir: directory of the XML files (ex: ../data/VOC2012_train_val/Annotations)
+    :param index_dir: directory of the index files, created if needed
+    :type annotations_dir: str
+    :type index_dir: str
+
+    :return: the built index
+    :rtype: AnnotationIndex
+    """
+    objects = {} # image id -> list of (name, xmin, ymin, xmax, ymax)
+
+    for root, dirs, files in os.walk(annotations_dir):
+        dirs.sort()
+        for file in sorted(files):
+            image_id, extension = os.path.splitext(file)
+            if extension != ".xml" or image_id in objects:
+                continue
+
+            objects[image_id] = [(obj.find("name").text,
+                                  *(int(float(obj.find("bndbox").find(tag).text)) for tag in ("xmin", "ymin", "xmax", "ymax")))
+                                 for obj in ET.parse(os.path.join(root, file)).getroot().findall("object")]
+
+    image_ids = sorted(objects)
+    categories = sorted({obj[0] for image_objects in objects.values() for obj in image_objects})
+    category_row = {category: i for i, category in enumerate(categories)}
+
+    group, boxes = [], []
+    for i, image_id in enumerate(image_ids):
+        for obj in objects[image_id]:
+            group.append(i * len(categories) + category_row[obj[0]])
+            boxes.append(obj[1:])
+
+    # group the objects by image and category, in the order of the XML file inside a group
+    group = np.array(group, dtype=np.int64)
+    order = np.argsort(group, kind="stable")
+    boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)[order]
+    assert(boxes.shape[0] == 0 or (boxes.min() >= np.iinfo(np.int16).min and boxes.max() <= np.iinfo(np.int16).max))
+
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(group, minlength=len(image_ids) * len(categories)))))
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "image_ids.npy"), np.array(image_ids, dtype=np.bytes_))
+    np.save(os.path.join(index_dir, "categories.npy"), np.array(categories, dtype=np.bytes_))
+    np.save(os.path.join(index_dir, "boxes.npy"), boxes.astype(np.int16))
+    np.save(os.path.join(index_dir, "offsets.npy"), offsets.astype(np.int64))
+
+    return AnnotationIndex(index_dir)
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 3:
+        index = build_annotation_index(sys.argv[1], sys.argv[2])
+        print(f"{len(index)} images, {index.boxes.shape[0]} objects, {index.categories.shape[0]} categories")
+    else:
+        print("USAGE\n\n\t$ python annotation_index.py [annotations_dir] [index_dir]\n")
+        print("annotations_dir : directory of the groundtruth xml files (ex: ../data/VOC2012_train_val/Annotations)")
+        print("index_dir       : directory where the index files are written (ex: ../data/VOC2012_train_val/AnnotationIndex)")
@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`batch` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Batch Module
+
+Evaluation of a grid dataset x method x parameters in a pool of processes,
+the result of each task is appended to a results store as soon as it completes
+so that a restarted batch skips the tasks already done
+
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+from multiprocessing.util import Finalize
+
+from dataset import VOC_ROOT, voc_dataset
+from image_loader import prefetch_images
+from results_store import ResultsStore
+
+# state of each worker process (cf. _init_worker)
+_worker = {}
+
+def make_tasks(records, methods=("felzenszwalb",), ks=(500,), n_comps=(9,), sigma=0.5, min_size=50):
+    """
+    Return lazily the tasks of the grid: each record with felzenszwalb for each k
+    and with watershed for each n_comp
+
+    :param records: records of the dataset (cf. dataset.voc_dataset)
+    :param methods: segmentation methods, felzenszwalb and/or watershed
+    :param ks: threshold constants of felzenszwalb
+    :param n_comps: numbers of regions of watershed
+    :param sigma: gaussian filter of felzenszwalb
+    :param min_size: minimum component size of felzenszwalb
+    :type records: iterable of ImageRecord
+    :type methods: tuple of str
+    :type ks: tuple of int
+    :type n_comps: tuple of int
+    :type sigma: float
+    :type min_size: int
+
+    :return: image id, category, image path, method and parameters of each task
+    :rtype: generator of dict
+    """
+    for record in records:
+        for method in methods:
+            if method == "felzenszwalb":
+                grid = [{"sigma": sigma, "k": int(k), "min_size": min_size} for k in ks]
+            else:
+                grid = [{"n_comp": int(n_comp)} for n_comp in n_comps]
+
+            for params in grid:
+                yield {"image_id": record.image_id, "category": record.category, "image_path": record.image_path,
+                       "gt_path": record.gt_path, "method": method, "params": params}
+
+def task_key(task: dict) -> str:
+    """
+    Return the key of the given task, unique in a grid and usable as a file name
+
+    :param task: the task (cf. make_tasks)
+    :type task: dict
+
+    :return: method, parameters, category and image id of the task
+    :rtype: str
+    """
+    params = "_".join(f"{name}={value}" for name, value in sorted(task["params"].items()))
+    return f"{task['method']}_{params}_{task['category']}_{task['image_id']}"
+
+def _init_worker(annotations_dir, gradient_cache_dir, render=False) -> None:
+    """
+    Load once per worker process the annotation index and the gradient cache,
+    and start the image writer of the rendered results
+
+    :param annotations_dir: directory of the annotation index, None to parse the groundtruth files
+    :param gradient_cache_dir: directory of the gradient cache, None to compute every gradient
+    :param render: True to render and save the result of each task (cf. render.render_segment)
+    :type annotations_dir: str
+    :type gradient_cache_dir: str
+    :type render: bool
+    """
+    from annotation_index import AnnotationIndex
+    from gradient_cache import GradientCache
+    from render import ImageWriter
+
+    _worker["annotations"] = None if annotations_dir is None else AnnotationIndex(annotations_dir)
+    _worker["cache"] = None if gradient_cache_dir is None else GradientCache(gradient_cache_dir)
+    _worker["writer"] = None
+    if render:
+        _worker["writer"] = ImageWriter()
+        # the queued images are written before the worker process exits
+        Finalize(None, _close_writer, exitpriority=10)
+
+def _close_writer() -> int:
+    """
+    Wait until the rendered results of this worker process are written and print
+    the results which could not be written
+
+    :return: number of results which could not be written
+    :rtype: int
+    """
+    writer = _worker.get("writer")
+    if writer is None:
+        return 0
+
+    _worker["writer"] = None
+    writer.close()
+    for path, error in writer.errors:
+        print(f"{path} not written : {error!r}", file=sys.stderr)
+    if writer.errors:
+        print(f"{len(writer.errors)} rendered results not written (process {os.getpid()})", file=sys.stderr)
+
+    return len(writer.errors)
+
+def run_task(task: dict, max_side=None, image=None) -> dict:
+    """
+    Segment and evaluate the image of the given task (cf. main.segmentation), without plot,
+    the result is rendered and saved in the background if the worker renders (cf. _init_worker)
+
+    :param task: the task (cf. make_tasks)
+    :param max_side: if given, the image is downscaled at decoding so that its largest side is at most max_side
+    :param image: if given, the image of the task already decoded and its scale (cf. image_loader.load_image)
+    :type task: dict
+    :type max_side: int
+    :type image: tuple (numpy.ndarray, tuple (float, float))
+
+    :return: the row of the task in the results store (cf. results_store.ResultsStore.append):
+             key, image id, category, method, parameters, ABO, number of regions and time of each stage
+    :rtype: dict
+    """
+    from main import segmentation
+
+    stats = {}
+    start_time = time.time()
+    if task["method"] == "felzenszwalb":
+        bb, _ = segmentation(task["image_path"],method="felzenszwalb",kwargs=task["params"],category=task["category"],
+                             gt_path="" if _worker.get("annotations") else task["gt_path"],save=True,plot=False,
+                             annotations=_worker.get("annotations"),stats=stats,writer=_worker.get("writer"),
+                             image=image,max_side=max_side)
+    else:
+        bb, _ = segmentation(task["image_path"],method="watershed",n_comp=task["params"]["n_comp"],category=task["category"],
+                             gt_path="" if _worker.get("annotations") else task["gt_path"],save=True,plot=False,
+                             annotations=_worker.get("annotations"),cache=_worker.get("cache"),stats=stats,writer=_worker.get("writer"),
+                             image=image,max_side=max_side)
+
+    return {"key": task_key(task), "image_id": task["image_id"], "category": task["category"],
+            "method": task["method"], "params": task["params"],
+            "abo": float(bb.abo.get(task["category"], 0)), "n_regions": bb.get_nb_bndbox(),
+            "decode_time": stats["decode_time"], "segment_time": stats["segment_time"],
+            "eval_time": stats["eval_time"], "total_time": time.time() - start_time}
+
+def run_batch(tasks, out_dir: str, workers=None, window=None, annotations_dir=None, gradient_cache_dir=None, render=False, max_side=None, verbose=True) -> dict:
+    """
+    Run the given tasks in a pool of processes, append the result of each task to the results store
+    of out_dir as soon as it completes and skip the tasks whose result is already stored.
+    Parallel batches (ex: one per shard) must use different directories, merged afterwards (cf. ResultsStore.merge)
+
+    :param tasks: the tasks (cf. make_tasks)
+    :param out_dir: directory of the results store
+    :param workers: number of processes, default the number of cpus, 0 to run the tasks in this process,
+                    where each image is decoded once for its consecutive tasks, ahead of the segmentation (cf. image_loader.prefetch_images)
+    :param window: maximum number of tasks submitted ahead, default 4 per process
+    :param annotations_dir: directory of the annotation index, None to parse the groundtruth files
+    :param gradient_cache_dir: directory of the gradient cache, None to compute every gradient
+    :param render: True to render and save the result of each task in RESULT_DIR/category (cf. render.render_segment)
+    :param max_side: if given, the images are downscaled at decoding so that their largest side is at most max_side,
+                     the groundtruth boxes are scaled accordingly
+    :param verbose: print the progress and the throughput
+    :type tasks: iterable of dict
+    :type out_dir: str
+    :type workers: int
+    :type window: int
+    :type annotations_dir: str
+    :type gradient_cache_dir: str
+    :type render: bool
+    :type max_side: int
+    :type verbose: bool
+
+    :return: number of tasks done, skipped and failed, elapsed time, MABO of the store (cf. ResultsStore.mabo)
+             and, in this process only, number of rendered results which could not be written (write_errors),
+             the worker processes print theirs when they exit
+    :rtype: dict
+    """
+    store = ResultsStore(out_dir)
+
+    tasks = list(tasks)
+    todo = [task for task in tasks if task_key(task) not in store]
+    summary = {"done": 0, "skipped": len(tasks) - len(todo), "failed": 0}
+    if verbose: print(f"{len(tasks)} tasks, {summary['skipped']} already done, {len(todo)} to run",end="\n\n")
+
+    start_time = time.time()
+
+    def report(task, result=None, error=None) -> None:
+        if error is None:
+            store.append(result)
+            summary["done"] += 1
+        else:
+            summary["failed"] += 1
+
+        if verbose:
+            finished = summary["done"] + summary["failed"]
+            elapsed = time.time() - start_time
+            rate = finished / elapsed if elapsed > 0 else 0
+            eta = (len(todo) - finished) / rate if rate > 0 else 0
+            status = f"abo = {result['abo']:.4f}" if error is None else f"failed : {error!r}"
+            print(f"[{finished}/{len(todo)}] {task_key(task)} {status} | {rate:.2f} tasks/s, ETA {int(eta)} s")
+
+    if workers == 0:
+        _init_worker(annotations_dir, gradient_cache_dir, render)
+        try:
+            # consecutive tasks of the same image (cf. make_tasks)
+            groups = deque(list(group) for _, group in groupby(todo, key=lambda task: task["image_path"]))
+            while groups:
+                images = prefetch_images([group[0]["image_path"] for group in groups], max_side=max_side)
+                while groups:
+                    group = groups.popleft()
+                    try:
+                        _, in_image, scale = next(images)
+                    except Exception as error:
+                        # the image can't be decoded, the prefetch restarts from the next image
+                        images.close()
+                        for task in group:
+                            report(task, error=error)
+                        break
+
+                    for task in group:
+                        try:
+                            report(task, run_task(task, max_side, (in_image, scale)))
+                        except Exception as error:
+                            report(task, error=error)
+        finally: # the rendered results are written even if the batch is interrupted
+            summary["write_errors"] = _close_writer()
+    else:
+        workers = workers or os.cpu_count()
+        window = window or 4 * workers
+        pending = {}
+        todo_iter = iter(todo)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(annotations_dir, gradient_cache_dir, render)) as executor:
+            def submit() -> None:
+                task = next(todo_iter, None)
+                if task is not None:
+                    pending[executor.submit(run_task, task, max_side)] = task
+
+            # keep at most window tasks submitted ahead, results are reported as they complete
+            for _ in range(window):
+                submit()
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = pending.pop(future)
+                    try:
+                        report(task, future.result())
+                    except Exception as error:
+                        report(task, error=error)
+                    submit()
+
+    store.close()
+    summary["elapsed_time"] = time.time() - start_time
+    summary["mabo"] = store.mabo()
+    if verbose:
+        print(f"\n{summary['done']} tasks done, {summary['failed']} failed in {summary['elapsed_time']:.1f} s "
+              f"({summary['done'] / max(summary['elapsed_time'], 1e-9):.2f} tasks/s)",end="\n\n")
+        if summary.get("write_errors"): print(f"{summary['write_errors']} rendered results not written",end="\n\n")
+        for (category, method, params), (mabo, count) in sorted(summary["mabo"].items()):
+            print(f"MABO {category} {method} {params} : {mabo:.4f} ({count} images)")
+
+    return summary
+
+def batch_main(argv: list) -> dict:
+    """
+    Parse the arguments of the batch subcommand of main.py and run the batch (cf. usage in main.py)
+
+    :param argv: arguments following batch
+    :type argv: list of str
+
+    :return: summary of the batch (cf. run_batch)
+    :rtype: dict
+    """
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Evaluate a grid dataset x method x parameters")
+    parser.add_argument("--root", default=VOC_ROOT, help="root of the dataset")
+    parser.add_argument("--categories", nargs="+", default=None, help="categories, default all")
+    parser.add_argument("--methods", nargs="+", default=["felzenszwalb"], choices=["felzenszwalb", "watershed"])
+    parser.add_argument("--k", nargs="+", type=int, default=[500], help="threshold constants of felzenszwalb")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--min-size", type=int, default=50)
+    parser.add_argument("--n-comp", nargs="+", type=int, default=[9], help="numbers of regions of watershed")
+    parser.add_argument("--shard", nargs=2, type=int, default=[0, 1], metavar=("I", "N"), help="run the shard I of N")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, default the number of cpus, 0 for none")
+    parser.add_argument("--out", default="../result/batch", help="directory of the results store")
+    parser.add_argument("--annotations", default=None, help="directory of the annotation index (cf. annotation_index.py)")
+    parser.add_argument("--gradient-cache", default=None, help="directory of the gradient cache of watershed")
+    parser.add_argument("--render", action="store_true", help="render and save the result of each task in ../result/category")
+    parser.add_argument("--max-side", type=int, default=None, help="downscale the images at decoding to this largest side")
+    parser.add_argument("--quiet", action="store_true", help="do not print the progress")
+    args = parser.parse_args(argv)
+
+    records = voc_dataset(args.root, categories=args.categories, shard=tuple(args.shard))
+    tasks = make_tasks(records, methods=args.methods, ks=args.k, n_comps=args.n_comp, sigma=args.sigma, min_size=args.min_size)
+
+    return run_batch(tasks, args.out, workers=args.workers, annotations_dir=args.annotations,
+                     gradient_cache_dir=args.gradient_cache, render=args.render, max_side=args.max_side, verbose=not args.quiet)
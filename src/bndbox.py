@@ -13,37 +13,106 @@ bndbox Module
 import numpy as np
 import pandas as pd
 from xml_parser import parse_XML
+from spatial_index import GridIndex
+
+# size in bytes of the dense overlap matrix (float64, one row per groundtruth, one column per bounding box)
+# above which start_eval matches groundtruths through a GridIndex : the switch only bounds the memory,
+# the temporaries of the dense matrix take about 6 times its size while the index takes memory
+# proportional to the candidate pairs, for the few groundtruths of an image the dense matrix is as fast or faster
+DENSE_MAX_BYTES = 1 << 27
 
 class BndBox:
     """
     Create a BndBox object which can calculate and evaluate bounding boxes
-    from segmented image and given ground truths
+    from segmented image and given ground truths.
+
+    Regions are stored in columns: sorted region ids (label), an (n,4) int32 array
+    of xmin, ymin, xmax, ymax (boxes), the number of pixels (count) and the
+    assigned color (color) of each region.
     """
-    def __init__(self,label: tuple, w: int,h: int):
+    def __init__(self,label: tuple, w: int,h: int,boxes=None,count=None):
         """
         Create a BndBox object which can calculate and evaluate bounding boxes
         from segmented image and given ground truths.
 
-        :param label:
-        :param w:
-        :param h:
+        :param label: id of each region
+        :param w: width of the segmented image
+        :param h: height of the segmented image
+        :param boxes: if given, xmin, ymin, xmax, ymax of each region (cf. extract_bndbox), otherwise boxes are built with check_pixel
+        :param count: if given, number of pixels of each region
 
-        :type label:
-        :type w:
-        :type h:
+        :type label: tuple or numpy.ndarray
+        :type w: int
+        :type h: int
+        :type boxes: numpy.ndarray of shape (len(label),4)
+        :type count: numpy.ndarray
 
         :UC: type(w) == type(h) == int
         :UC: 0 < w and 0 < h     
         """
-        self.bndbox = {str(comp) : np.array([[w-1,0],[w*h-1,0]]) for comp in label}
+        label = np.asarray(label, dtype=np.int64).ravel()
+        order = np.argsort(label, kind="stable")
+        self.label = label[order]
+
+        if boxes is None:
+            # empty boxes, extended by check_pixel
+            self.boxes = np.tile(np.array([w-1,h-1,0,0], dtype=np.int32), (self.label.shape[0],1))
+        else:
+            self.boxes = np.asarray(boxes, dtype=np.int32)[order]
+        self.count = None if count is None else np.asarray(count)[order]
+        self.color = np.full(shape=self.label.shape[0], fill_value="r")
+        self._index = None # GridIndex of the boxes, built on demand (cf. _best_indexed)
+
         self.overlap_05 = {}
         self.max_overlap = {}
         self.abo = {}
-        self.bndbox_color = {}
-        self.df_bndbox = pd.DataFrame(columns=['name','xmin','ymin','xmax','ymax'])
+        self.gt_names = np.zeros(shape=0, dtype=object)
+        self.gt_boxes = np.zeros(shape=(0,4), dtype=np.int64)
         self.w = w
         self.h = h
 
+    @classmethod
+    def from_labels(cls,labels: np.ndarray) -> "BndBox":
+        """
+        Create the BndBox object of the regions of the given label map
+
+        :param labels: label map of a segmentation, id of the region of each pixel
+        :type labels: numpy.ndarray of shape (h,w)
+
+        :return: the bounding boxes of each region
+        :rtype: BndBox
+        """
+        h, w = labels.shape
+        label, boxes, count = extract_bndbox(labels)
+        return cls(label,w,h,boxes=boxes,count=count)
+
+    def subset(self,rows: np.ndarray) -> "BndBox":
+        """
+        Create the BndBox object of the given regions only
+
+        :param rows: rows of the regions to keep in label, boxes and color
+        :type rows: numpy.ndarray
+
+        :return: the bounding boxes of the given regions
+        :rtype: BndBox
+        """
+        count = None if self.count is None else self.count[rows]
+        return BndBox(self.label[rows],self.w,self.h,boxes=self.boxes[rows],count=count)
+
+    def _row(self,comp: str) -> int:
+        """
+        Return the row of the given region id in the columns
+
+        :param comp: id of the region
+        :type comp: str
+
+        :return: index of the region in label, boxes and color
+        :rtype: int
+
+        :UC: comp must be in self.get_bndbox_id()
+        """
+        return int(np.searchsorted(self.label, int(comp)))
+
     def get_bndbox(self,comp: str) -> np.array:
         """
         Return for a given region id the array of pixel id of each ends,
@@ -59,18 +128,30 @@ class BndBox:
 
         :UC: type(comp) == str
         """
-        return self.bndbox[comp]
+        xmin, ymin, xmax, ymax = self.boxes[self._row(comp)].tolist()
+        return np.array([[xmin,xmax],[ymin*self.w+xmin,ymax*self.w+xmax]])
+
+    def get_boxes(self) -> np.ndarray:
+        """
+        Return the box of each region, in the order of get_bndbox_id
+
+        :return: xmin, ymin, xmax, ymax of each region
+        :rtype: numpy.ndarray of shape (n,4)
+
+        :UC: None
+        """
+        return self.boxes
     
     def get_bndbox_id(self):
         """
         Return the bounding box id of each regions
 
         :return: bndbox id of each regions
-        :rtype: dict_keys()
+        :rtype: list of str
 
         :UC: None
         """
-        return self.bndbox.keys()
+        return [str(comp) for comp in self.label.tolist()]
     
     def get_nb_bndbox(self) -> int:
         """
@@ -81,7 +162,7 @@ class BndBox:
 
         :UC: None
         """
-        return len(list(self.get_bndbox_id()))
+        return self.label.shape[0]
     
     def get_bndbox_color(self,comp : str) -> str:
         """
@@ -95,9 +176,32 @@ class BndBox:
         :return: assigned color for the given bounding box id (red or green)
         :rtype: str
 
-        :UC: comp must be in self.bndbox.keys()
+        :UC: comp must be in self.get_bndbox_id()
+        """
+        return str(self.color[self._row(comp)])
+
+    def get_colors(self) -> np.ndarray:
+        """
+        Return the assigned color of each region, in the order of get_bndbox_id
+
+        :return: color of each region (r or g)
+        :rtype: numpy.ndarray of str
+
+        :UC: None
+        """
+        return self.color
+
+    @property
+    def df_bndbox(self) -> pd.DataFrame:
         """
-        return self.bndbox_color[comp]
+        Return the groundtruths of the evaluation as a dataframe, built on demand
+
+        :return: name, xmin, ymin, xmax, ymax of each groundtruth
+        :rtype: pandas.DataFrame
+        """
+        df = pd.DataFrame(self.gt_boxes, columns=['xmin','ymin','xmax','ymax'])
+        df.insert(0, 'name', self.gt_names)
+        return df
 
     def init_eval(self,gt_path: str,category: str) -> None:
         """
@@ -113,11 +217,30 @@ class BndBox:
 
         :UC: None
         """
-        self.df_bndbox = parse_XML(gt_path,category) # dataframe of the given category groundthruth
-        self.overlap_05 = {i : ('None',0) for i in range(self.df_bndbox.shape[0])} # all overlap > 0.5
-        self.max_overlap = {i : ('None',0) for i in range(self.df_bndbox.shape[0])} # max overlap
-        self.abo = {name : 0 for name in np.unique(self.df_bndbox["name"].values)} # ABO for each groundtruth of category
-        self.bndbox_color = {comp : "r" for comp in list(self.get_bndbox_id())} # color assigned to each bounding box
+        df_bndbox = parse_XML(gt_path,category) # dataframe of the given category groundthruth
+        self.init_eval_boxes(df_bndbox[["xmin","ymin","xmax","ymax"]].to_numpy(dtype=np.int64),category)
+
+    def init_eval_boxes(self,gt_boxes: np.ndarray,category: str) -> None:
+        """
+        Init dictionaries in order to perform the evaluation phase from the given
+        groundtruth boxes (cf. AnnotationIndex.lookup) instead of a groundtruth file
+
+        :param gt_boxes: xmin, ymin, xmax, ymax of each groundtruth of the category
+        :param category: category name of objects to detect in images
+        :type gt_boxes: numpy.ndarray of shape (g,4)
+        :type category: str
+
+        :return: None
+        :rtype: None
+
+        :UC: None
+        """
+        self.gt_boxes = np.asarray(gt_boxes, dtype=np.int64).reshape(-1,4) # groundthruth boxes as array
+        self.gt_names = np.full(shape=self.gt_boxes.shape[0], fill_value=category, dtype=object) # category of each groundtruth
+        self.overlap_05 = {i : ('None',0) for i in range(self.gt_boxes.shape[0])} # all overlap > 0.5
+        self.max_overlap = {i : ('None',0) for i in range(self.gt_boxes.shape[0])} # max overlap
+        self.abo = {name : 0 for name in np.unique(self.gt_names)} # ABO for each groundtruth of category
+        self.color[:] = "r" # color assigned to each bounding box
 
     def check_pixel(self,comp: str,pixel_id: int) -> None:
         """
@@ -131,21 +254,15 @@ class BndBox:
         :return: None
         :rtype: None
         """
-        # most left
-        if self.bndbox[comp][0][0]%self.w > pixel_id%self.w: 
-            self.bndbox[comp][0][0] = pixel_id
-
-        # most right
-        if self.bndbox[comp][0][1]%self.w < pixel_id%self.w:
-            self.bndbox[comp][0][1] = pixel_id
+        box = self.boxes[self._row(comp)]
+        y, x = divmod(pixel_id, self.w)
+        self._index = None
 
-        # most up
-        if self.bndbox[comp][1][0] > pixel_id: 
-            self.bndbox[comp][1][0] = pixel_id
-        
-        # most down
-        if self.bndbox[comp][1][1] < pixel_id:
-            self.bndbox[comp][1][1] = pixel_id
+        # most left, most up, most right, most down
+        box[0] = min(box[0], x)
+        box[1] = min(box[1], y)
+        box[2] = max(box[2], x)
+        box[3] = max(box[3], y)
 
     def overlap(self,l1, r1, l2, r2):
         """
@@ -190,17 +307,25 @@ class BndBox:
         :return: None
         :rtype: None
         """
-        l_label = np.unique(self.df_bndbox['name'])
+        names = self.gt_names
+        max_overlap = np.array([self.max_overlap[i][1] for i in range(len(names))], dtype=float)
 
-        for label in l_label:
-            index = (self.df_bndbox['name'] == label).values
+        for label in np.unique(names):
+            index = names == label
 
-            self.abo[label] = (1/len(index)) * np.sum(self.max_overlap[i][1] for i in np.arange(0,len(self.max_overlap.keys()),1)[index])  
+            self.abo[label] = (1/np.count_nonzero(index)) * sum(max_overlap[index].tolist())
 
     def start_eval(self,verbose=False) -> None:
         """
         Launch the evaluation phase of quality of bounding boxes calculated
-        compared with ground truths by using the measure of average overlap
+        compared with ground truths by using the measure of average overlap.
+
+        The overlaps of every groundtruth with every bounding box are computed at once
+        (cf. iou_matrix), each groundtruth keeps its best bounding box (max_overlap, and
+        overlap_05 if the overlap is > 0.5) and the bounding boxes kept in overlap_05 are green.
+        If the dense overlap matrix would take more than DENSE_MAX_BYTES, each groundtruth
+        is only compared with the bounding boxes which can intersect it (cf. GridIndex),
+        which bounds the memory of the evaluation of very large proposal sets
         
         :param verbose: verbosity
         :type verbose: bool
@@ -208,26 +333,150 @@ class BndBox:
         :return: None
         :rtype: None
         """
-        for i in range(self.df_bndbox.shape[0]):
+        self.color[:] = "r"
+        if self.get_nb_bndbox() == 0:
+            self._eval_abo()
+            return
 
-            l1 = (self.df_bndbox.iloc[:,1:]["xmin"][i],self.df_bndbox.iloc[:,1:]["ymax"][i])
-            r1 = (self.df_bndbox.iloc[:,1:]["xmax"][i],self.df_bndbox.iloc[:,1:]["ymin"][i])
+        if self.gt_boxes.shape[0] * self.get_nb_bndbox() * 8 > DENSE_MAX_BYTES:
+            best, best_overlap = self._best_indexed(verbose)
+        else:
+            overlaps = iou_matrix(self.gt_boxes, self.boxes)
+            if verbose: print(overlaps)
 
-            for comp in self.get_bndbox_id():
-    
-                l2 = (int(self.get_bndbox(comp)[0][0]%self.w),int(self.get_bndbox(comp)[1][1]/self.w))
-                r2 = (int(self.get_bndbox(comp)[0][1]%self.w),int(self.get_bndbox(comp)[1][0]/self.w))
-        
-                tmp_overlap = self.overlap(l1,r1,l2,r2)
-
-                if verbose: print(i,comp,tmp_overlap,self.overlap_05[i][1])
-                
-                if tmp_overlap > 0.5 and tmp_overlap > self.overlap_05[i][1]:
-                    self.bndbox_color[self.overlap_05[i][0]] = "r"
-                    self.overlap_05[i] = (comp,tmp_overlap)
-                    self.bndbox_color[comp] = "g"
-                if tmp_overlap > self.max_overlap[i][1]:
-                    self.max_overlap[i] = (comp,tmp_overlap)
+            best = np.argmax(overlaps, axis=1)
+            best_overlap = overlaps[np.arange(overlaps.shape[0]), best]
+
+        for i, (row, value) in enumerate(zip(best.tolist(), best_overlap.tolist())):
+            if value > 0:
+                self.max_overlap[i] = (str(self.label[row]), value)
+            if value > 0.5:
+                self.overlap_05[i] = (str(self.label[row]), value)
+
+        self.color[best[best_overlap > 0.5]] = "g"
         
         # calculate ABO for each category of groundtruth
-        self._eval_abo()
\ No newline at end of file
+        self._eval_abo()
+
+    def _best_indexed(self,verbose=False) -> tuple:
+        """
+        Return the best bounding box of each groundtruth and its overlap, comparing
+        each groundtruth only with its candidates in a GridIndex of the bounding boxes,
+        all the groundtruths at once. The index is kept for the next evaluations
+
+        :param verbose: verbosity
+        :type verbose: bool
+
+        :return: row of the best bounding box (first one in case of tie) and its overlap for each groundtruth
+        :rtype: tuple (numpy.ndarray, numpy.ndarray)
+        """
+        if self._index is None:
+            self._index = GridIndex(self.boxes)
+
+        gt_ids, candidates = self._index.query_pairs(self.gt_boxes)
+        overlaps = iou_pairs(self.gt_boxes[gt_ids], self.boxes[candidates])
+        if verbose: print(gt_ids, candidates, overlaps)
+
+        best = np.zeros(shape=self.gt_boxes.shape[0], dtype=np.int64)
+        best_overlap = np.zeros(shape=self.gt_boxes.shape[0])
+        if gt_ids.shape[0] == 0:
+            return best, best_overlap
+
+        # pairs are grouped by groundtruth : best overlap of each group, ties keep the first bounding box
+        gt_ids, start = np.unique(gt_ids, return_index=True)
+        best_overlap[gt_ids] = np.maximum.reduceat(overlaps, start)
+        best_rows = np.where(overlaps == np.repeat(best_overlap[gt_ids], np.diff(np.append(start, overlaps.shape[0]))),
+                             candidates, self.get_nb_bndbox())
+        best[gt_ids] = np.minimum.reduceat(best_rows, start)
+
+        return best, best_overlap
+
+def iou_matrix(gt_boxes: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Calculate the overlap (intersection over union, cf. BndBox.overlap) of each
+    given groundtruth box with each given box in one broadcast operation
+
+    :param gt_boxes: xmin, ymin, xmax, ymax of each groundtruth
+    :param boxes: xmin, ymin, xmax, ymax of each bounding box
+    :type gt_boxes: numpy.ndarray of shape (g,4)
+    :type boxes: numpy.ndarray of shape (n,4)
+
+    :return: overlap of each groundtruth (rows) with each bounding box (columns), 0 if they don't overlap
+    :rtype: numpy.ndarray of shape (g,n)
+    """
+    return iou_pairs(np.asarray(gt_boxes, dtype=np.int64)[:, None, :], np.asarray(boxes, dtype=np.int64)[None, :, :])
+
+def iou_pairs(gt_boxes: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Calculate the overlap (intersection over union, cf. BndBox.overlap) of each
+    given groundtruth box with the given box at the same position (with broadcasting)
+
+    :param gt_boxes: xmin, ymin, xmax, ymax of each groundtruth
+    :param boxes: xmin, ymin, xmax, ymax of each bounding box
+    :type gt_boxes: numpy.ndarray of shape (...,4)
+    :type boxes: numpy.ndarray of shape (...,4)
+
+    :return: overlap of each pair, 0 if they don't overlap
+    :rtype: numpy.ndarray of the broadcast shape without the last axis
+    """
+    gt_boxes = np.asarray(gt_boxes, dtype=np.int64)
+    boxes = np.asarray(boxes, dtype=np.int64)
+
+    area1 = np.abs(gt_boxes[..., 2] - gt_boxes[..., 0]) * np.abs(gt_boxes[..., 3] - gt_boxes[..., 1])
+    area2 = np.abs(boxes[..., 2] - boxes[..., 0]) * np.abs(boxes[..., 3] - boxes[..., 1])
+
+    x_dist = np.minimum(gt_boxes[..., 2], boxes[..., 2]) - np.maximum(gt_boxes[..., 0], boxes[..., 0])
+    y_dist = np.minimum(gt_boxes[..., 3], boxes[..., 3]) - np.maximum(gt_boxes[..., 1], boxes[..., 1])
+
+    area_i = np.where((x_dist > 0) & (y_dist > 0), x_dist * y_dist, 0)
+    union = area1 + area2 - area_i
+
+    return np.divide(area_i, union, out=np.zeros(shape=area_i.shape), where=area_i > 0)
+
+def extract_bndbox(labels: np.ndarray) -> tuple:
+    """
+    Compute the bounding box and the number of pixels of each region of the
+    given label map in a single grouped reduction
+
+    :param labels: label map of a segmentation, id of the region of each pixel
+    :type labels: numpy.ndarray of shape (h,w)
+
+    :return: sorted region ids, xmin, ymin, xmax, ymax of each region and number of pixels of each region
+    :rtype: tuple (numpy.ndarray, numpy.ndarray of shape (n,4), numpy.ndarray)
+    """
+    w = labels.shape[1]
+    label, index, count = np.unique(labels.ravel(), return_inverse=True, return_counts=True)
+
+    # pixel ids grouped by region, in increasing order inside each group
+    pixel_id = np.argsort(index, kind="stable")
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    y, x = np.divmod(pixel_id, w)
+
+    boxes = np.empty(shape=(label.shape[0], 4), dtype=np.int32)
+    boxes[:, 0] = np.minimum.reduceat(x, start)
+    boxes[:, 1] = y[start]
+    boxes[:, 2] = np.maximum.reduceat(x, start)
+    boxes[:, 3] = y[start + count - 1]
+
+    return label, boxes, count
+
+def concat_bndbox(bbs: list) -> BndBox:
+    """
+    Gather the bounding boxes of several segmentations of the same image
+    (several k values, felzenszwalb and watershed) in one BndBox object,
+    the regions are numbered from 0 in the order of the given BndBox objects
+
+    :param bbs: BndBox objects of the segmentations
+    :type bbs: list of BndBox
+
+    :return: the bounding boxes of every given segmentation
+    :rtype: BndBox
+
+    :UC: len(bbs) > 0 and every BndBox has the same w and h
+    """
+    boxes = np.concatenate([bb.get_boxes() for bb in bbs])
+    count = None
+    if all(bb.count is not None for bb in bbs):
+        count = np.concatenate([bb.count for bb in bbs])
+
+    return BndBox(np.arange(boxes.shape[0]),bbs[0].w,bbs[0].h,boxes=boxes,count=count)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`dataset` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Dataset Module
+
+Streaming over the VOC2012 category tree (JPEGImages/<category>/XXXX.jpg
+and Annotations/<category>/XXXX.xml), one record at a time
+
+"""
+
+import os
+import numpy as np
+
+from image_loader import load_image, scale_boxes
+from xml_parser import parse_XML
+
+# default root of the dataset, from the src directory
+VOC_ROOT = "../data/VOC2012_train_val"
+
+class ImageRecord:
+    """
+    Create an ImageRecord object which designates an image of the dataset and its category,
+    the image and the groundtruth are only read on demand
+    """
+    def __init__(self, image_id: str, category: str, image_path: str, gt_path: str):
+        """
+        Create an ImageRecord object which designates an image of the dataset and its category,
+        the image and the groundtruth are only read on demand
+
+        :param image_id: id of the image (name of the file without extension)
+        :param category: category of the image
+        :param image_path: path of the image
+        :param gt_path: path of the groundtruth xml file
+        :type image_id: str
+        :type category: str
+        :type image_path: str
+        :type gt_path: str
+        """
+        self.image_id = image_id
+        self.category = category
+        self.image_path = image_path
+        self.gt_path = gt_path
+
+    def __repr__(self) -> str:
+        return f"ImageRecord({self.image_id!r}, {self.category!r})"
+
+    def load_image(self, max_side=None) -> tuple:
+        """
+        Decode the image (cf. image_loader.load_image)
+
+        :param max_side: maximum side of the decoded image, None to keep the original size
+        :type max_side: int
+
+        :return: the image and its scale (decoded / original) along x and y, to give to ground_truth
+        :rtype: tuple (numpy.ndarray of uint8 of shape (height,width,3), tuple (float, float))
+        """
+        return load_image(self.image_path, max_side=max_side)
+
+    def ground_truth(self, annotations=None, scale=(1.0, 1.0)) -> np.ndarray:
+        """
+        Return the groundtruth boxes of the category of the image, looked up in the given
+        annotation index, otherwise parsed from the groundtruth file, in the coordinates
+        of the image decoded with the given scale (cf. load_image)
+
+        :param annotations: annotation index of the dataset
+        :param scale: scale of the decoded image along x and y
+        :type annotations: AnnotationIndex
+        :type scale: tuple (float, float)
+
+        :return: xmin, ymin, xmax, ymax of each groundtruth
+        :rtype: numpy.ndarray of shape (g,4)
+        """
+        if annotations is not None:
+            gt_boxes = annotations.lookup(self.image_id, self.category)
+        else:
+            gt_boxes = parse_XML(self.gt_path, self.category)[["xmin","ymin","xmax","ymax"]].to_numpy(dtype=np.int64)
+        return scale_boxes(gt_boxes, scale)
+
+def voc_dataset(root=VOC_ROOT, categories=None, shard=(0, 1), keep=None):
+    """
+    Walk lazily the images of the given categories, in the order of the categories then
+    of the image ids, and yield the records of the given shard: shard (i, n) keeps
+    the records whose position in this order is i modulo n, so n workers with i from 0 to n-1
+    cover the dataset exactly once
+
+    :param root: root of the dataset, which contains JPEGImages and Annotations
+    :param categories: categories to walk, by default every directory of JPEGImages
+    :param shard: index i and number n of shards
+    :param keep: if given, only the records for which keep(record) is True are yielded,
+                 it is applied after the sharding so that the shards don't depend on it
+    :type root: str
+    :type categories: list of str
+    :type shard: tuple (int, int)
+    :type keep: function
+
+    :return: the records of the shard
+    :rtype: generator of ImageRecord
+
+    :UC: 0 <= shard[0] < shard[1]
+    """
+    index, n_shards = shard
+    assert(0 <= index < n_shards)
+
+    if categories is None:
+        categories = sorted(entry.name for entry in os.scandir(os.path.join(root, "JPEGImages")) if entry.is_dir())
+
+    position = 0
+    for category in categories:
+        image_dir = os.path.join(root, "JPEGImages", category)
+        for file in sorted(entry.name for entry in os.scandir(image_dir) if entry.is_file()):
+            image_id, extension = os.path.splitext(file)
+            if extension.lower() not in (".jpg", ".jpeg", ".png"):
+                continue
+
+            position += 1
+            if (position - 1) % n_shards != index:
+                continue
+
+            record = ImageRecord(image_id, category, os.path.join(image_dir, file),
+                                 os.path.join(root, "Annotations", category, image_id + ".xml"))
+            if keep is None or keep(record):
+                yield record
+
+def annotation_path(image_path: str, category: str) -> str:
+    """
+    Return the path of the groundtruth file of the given image of the dataset
+    (root/JPEGImages/category/XXXX.jpg -> root/Annotations/category/XXXX.xml)
+
+    :param image_path: path of the image
+    :param category: category of the image
+    :type image_path: str
+    :type category: str
+
+    :return: path of the groundtruth xml file
+    :rtype: str
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(image_path)))
+    image_id = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(root, "Annotations", category, image_id + ".xml")
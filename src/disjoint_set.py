@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`disjoint_set` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Disjoint Set Module
+
+Array-backed disjoint-set forest (union by rank, path halving) and the
+sorted-edge merge of the felzenszwalb segmentation.
+
+The merge runs in a Numba-compiled kernel when numba is installed,
+otherwise the same kernel runs on plain python lists.
+
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError: # numba is optional
+    njit = None
+
+HAS_NUMBA = njit is not None
+
+class DisjointSet:
+    """
+    Create a DisjointSet object to represent a disjoint-set forest with
+    separate contiguous parent, rank and size arrays
+    """
+    def __init__(self, n_elements: int):
+        """
+        Create a DisjointSet object to represent a disjoint-set forest with
+        separate contiguous parent, rank and size arrays
+
+        :param n_elements: number of elements (pixels/vertices)
+        :type n_elements: int
+        :build: a clean DisjointSet for the given number of elements
+        """
+        self.num = n_elements
+        self.parent = np.arange(n_elements, dtype=np.int32)
+        self.rank = np.zeros(shape=n_elements, dtype=np.int32)
+        self.set_size = np.ones(shape=n_elements, dtype=np.int32)
+
+    def size(self, x: int) -> int:
+        """
+        Returns the size of the component to which the given pixel id belongs
+
+        :param x: the pixel id
+        :type x: int
+
+        :return: the size of the component
+        :rtype: int
+
+        :UC: x must be a component id (cf. find)
+        """
+        return int(self.set_size[x])
+
+    def num_sets(self) -> int:
+        """
+        Return the number of components
+
+        :return: number of components
+        :rtype: int
+
+        :UC: None
+        """
+        return self.num
+
+    def find(self, x: int) -> int:
+        """
+        Return the component id for a given pixel id, halving the path on the way
+
+        :param x: pixel id
+        :type x: int
+
+        :return: the component id
+        :rtype: int
+
+        :UC: x >= 0
+        """
+        parent = self.parent
+        x = int(x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = int(parent[x])
+        return x
+
+    def join(self, x: int, y: int) -> None:
+        """
+        Merge the components x and y, the component of higher rank absorbs the other
+
+        :param x: the first component id
+        :param y: the second component id
+        :type x: int
+        :type y: int
+
+        :return: None
+        :rtype: None
+
+        :UC: x and y must be component ids (cf. find)
+        """
+        if self.rank[x] > self.rank[y]:
+            self.parent[y] = x
+            self.set_size[x] += self.set_size[y]
+        else:
+            self.parent[x] = y
+            self.set_size[y] += self.set_size[x]
+            if self.rank[x] == self.rank[y]:
+                self.rank[y] += 1
+        self.num -= 1
+
+    def find_all(self, x: np.ndarray) -> np.ndarray:
+        """
+        Vectorized find, return the component id of each given pixel id
+        without modifying the forest
+
+        :param x: pixel ids
+        :type x: numpy.ndarray
+
+        :return: the component id of each pixel id
+        :rtype: numpy.ndarray
+
+        :UC: x >= 0
+        """
+        x = self.parent[x]
+        while True:
+            parent = self.parent[x]
+            if np.array_equal(parent, x):
+                return x
+            x = parent
+
+    def roots(self) -> np.ndarray:
+        """
+        Return the component id of every element, the forest is flattened
+        on the way by vectorized pointer jumping (each element then points to its root)
+
+        :return: the component id of each element
+        :rtype: numpy.ndarray
+
+        :UC: None
+        """
+        parent = self.parent
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+        self.parent[:] = parent
+        return self.parent.copy()
+
+def merge_sorted_edges(forest: DisjointSet, edges_a: np.ndarray, edges_b: np.ndarray, weights: np.ndarray, c: float, threshold=None, compiled=None) -> int:
+    """
+    Run the whole felzenszwalb merge over the given sorted edges: the components
+    of an edge are joined when its weight is below both component thresholds,
+    then the threshold of the new component becomes weight + c / size
+
+    :param forest: the disjoint-set forest to update
+    :param edges_a: first end of each edge
+    :param edges_b: second end of each edge
+    :param weights: weight of each edge
+    :param c: constant for threshold function
+    :param threshold: threshold of each component, updated in place, c / 1 for each element if None
+    :param compiled: True to use the numba kernel, False for the pure python one, None to use numba when installed
+    :type forest: DisjointSet
+    :type edges_a: numpy.ndarray
+    :type edges_b: numpy.ndarray
+    :type weights: numpy.ndarray
+    :type c: float
+    :type threshold: numpy.ndarray
+    :type compiled: bool
+
+    :return: number of merges performed
+    :rtype: int
+
+    :UC: edges must be sorted by non-decreasing weight
+    """
+    if threshold is None:
+        threshold = np.full(shape=forest.parent.shape[0], fill_value=c, dtype=np.float64) # c / 1
+
+    if compiled is None:
+        compiled = HAS_NUMBA
+
+    if compiled:
+        num_merges = _merge_compiled(forest.parent, forest.rank, forest.set_size, threshold,
+                                     edges_a, edges_b, weights, c)
+    else:
+        parent, rank, set_size, thr = (forest.parent.tolist(), forest.rank.tolist(),
+                                       forest.set_size.tolist(), threshold.tolist())
+        num_merges = _merge_kernel(parent, rank, set_size, thr,
+                                   edges_a.tolist(), edges_b.tolist(), weights.tolist(), c)
+        forest.parent[:] = parent
+        forest.rank[:] = rank
+        forest.set_size[:] = set_size
+        threshold[:] = thr
+
+    forest.num -= num_merges
+
+    return num_merges
+
+def merge_small_components(forest: DisjointSet, edges_a: np.ndarray, edges_b: np.ndarray, min_size: int, compiled=None) -> int:
+    """
+    Post-process the segmentation: following the sorted edges, join the two components
+    of an edge when one of them is smaller than min_size.
+
+    Components only grow, so only the edges touching a component already smaller than
+    min_size before the pass can lead to a merge, they are selected in bulk
+    and are the only ones visited in order. The edges can thus be given
+    chunk by chunk in sorted order.
+
+    :param forest: the disjoint-set forest to update
+    :param edges_a: first end of each edge
+    :param edges_b: second end of each edge
+    :param min_size: minimum component size
+    :param compiled: True to use the numba kernel, False for the pure python one, None to use numba when installed
+    :type forest: DisjointSet
+    :type edges_a: numpy.ndarray
+    :type edges_b: numpy.ndarray
+    :type min_size: int
+    :type compiled: bool
+
+    :return: number of merges performed
+    :rtype: int
+
+    :UC: edges must be sorted by non-decreasing weight
+    """
+    root_a = forest.find_all(edges_a)
+    root_b = forest.find_all(edges_b)
+    small = forest.set_size < min_size
+
+    candidates = np.flatnonzero((root_a != root_b) & (small[root_a] | small[root_b]))
+    if candidates.shape[0] == 0:
+        return 0
+    root_a = root_a[candidates]
+    root_b = root_b[candidates]
+
+    if compiled is None:
+        compiled = HAS_NUMBA
+
+    if compiled:
+        num_merges = _small_compiled(forest.parent, forest.rank, forest.set_size, root_a, root_b, min_size)
+    else:
+        parent, rank, set_size = forest.parent.tolist(), forest.rank.tolist(), forest.set_size.tolist()
+        num_merges = _small_kernel(parent, rank, set_size, root_a.tolist(), root_b.tolist(), min_size)
+        forest.parent[:] = parent
+        forest.rank[:] = rank
+        forest.set_size[:] = set_size
+
+    forest.num -= num_merges
+
+    return num_merges
+
+def _merge_kernel(parent, rank, set_size, threshold, edges_a, edges_b, weights, c):
+    """
+    Felzenszwalb merge loop over sorted edges, written to run both on python lists
+    and compiled by numba on numpy arrays (find and join are inlined for numba)
+
+    :return: number of merges performed
+    :rtype: int
+    """
+    num_merges = 0
+    for i in range(len(weights)):
+        a = edges_a[i]
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        b = edges_b[i]
+        while parent[b] != b:
+            parent[b] = parent[parent[b]]
+            b = parent[b]
+
+        if a != b:
+            w = weights[i]
+            if w <= threshold[a] and w <= threshold[b]:
+                if rank[a] > rank[b]:
+                    parent[b] = a
+                    set_size[a] += set_size[b]
+                else:
+                    parent[a] = b
+                    set_size[b] += set_size[a]
+                    if rank[a] == rank[b]:
+                        rank[b] += 1
+                    a = b
+                threshold[a] = w + c / set_size[a]
+                num_merges += 1
+
+    return num_merges
+
+def _small_kernel(parent, rank, set_size, edges_a, edges_b, min_size):
+    """
+    Small components merge loop over sorted edges, written to run both on python lists
+    and compiled by numba on numpy arrays (find and join are inlined for numba)
+
+    :return: number of merges performed
+    :rtype: int
+    """
+    num_merges = 0
+    for i in range(len(edges_a)):
+        a = edges_a[i]
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        b = edges_b[i]
+        while parent[b] != b:
+            parent[b] = parent[parent[b]]
+            b = parent[b]
+
+        if a != b and (set_size[a] < min_size or set_size[b] < min_size):
+            if rank[a] > rank[b]:
+                parent[b] = a
+                set_size[a] += set_size[b]
+            else:
+                parent[a] = b
+                set_size[b] += set_size[a]
+                if rank[a] == rank[b]:
+                    rank[b] += 1
+            num_merges += 1
+
+    return num_merges
+
+_merge_compiled = njit(cache=True)(_merge_kernel) if HAS_NUMBA else None
+_small_compiled = njit(cache=True)(_small_kernel) if HAS_NUMBA else None
@@ -21,13 +21,14 @@ np.seterr(over='ignore')
 WIDTH = 4.0
 
 
-# convolve image with gaussian filter
+# convolve image with gaussian filter, the channels of a (height,width,3) image
+# are smoothed in a single pass, result is float32
 def smooth(src, sigma):
     mask = make_fgauss(sigma)
     mask = normalize(mask)
     tmp = convolve_even(src, mask)
     dst = convolve_even(tmp, mask)
-    return dst
+    return dst.astype(np.float32)
 
 
 # gaussian filter
@@ -46,16 +47,22 @@ def normalize(mask):
     return np.divide(mask, sum)
 
 
-# convolve src with mask.  output is flipped!
+# convolve src with mask along the rows, borders are clamped.  output is flipped!
+# (it is not transposed, so smooth filters the rows twice)
 def convolve_even(src, mask):
-    output = np.zeros(shape=src.shape, dtype=float)
-    height, width = src.shape
+    width = src.shape[1]
     length = len(mask)
 
-    for y in range(height):
-        for x in range(width):
-            sum = float(mask[0] * src[y, x])
-            for i in range(1, length):
-                sum += mask[i] * (src[y, max(x - i, 0)] + src[y, min(x + i, width - 1)])
-            output[y, x] = sum
+    # replicate the first and last columns length - 1 times
+    pad_width = [(0, 0)] * src.ndim
+    pad_width[1] = (length - 1, length - 1)
+    padded = np.pad(src, pad_width, mode="edge")
+
+    output = mask[0] * src.astype(float)
+    for i in range(1, length):
+        left = padded[:, length - 1 - i:length - 1 - i + width]
+        right = padded[:, length - 1 + i:length - 1 + i + width]
+        # the pair is summed in the dtype of src as with the former per-pixel loop
+        # (uint8 sums wrap around, cf. np.seterr)
+        output += mask[i] * (left + right)
     return output
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`gradient_cache` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Gradient Cache Module
+
+On-disk cache of gradient images (SED edges of the watershed segmentation),
+addressed by the content of the image and the identity of the model,
+stored as float32 .npy files read back by memory mapping
+
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import numpy as np
+
+# default size cap of the cache in bytes
+MAX_BYTES = 1 << 30
+# environment variable giving the directory of the SED model file and of the gradient cache
+SED_CACHE_ENV = "SED_CACHE_DIR"
+
+def sed_cache_dir() -> str:
+    """
+    Return the cache directory of the watershed segmentation, which holds the SED model file
+    (cf. segment_watershed.get_sed_model_file) and the gradients subdirectory of the default GradientCache
+
+    :return: the SED_CACHE_DIR environment variable, default ~/.cache/m1-pji
+    :rtype: str
+    """
+    return os.environ.get(SED_CACHE_ENV, os.path.join(os.path.expanduser("~"), ".cache", "m1-pji"))
+
+class GradientCache:
+    """
+    Create a GradientCache object which stores gradient images in a directory,
+    the least recently used files are evicted above a size cap
+    """
+    def __init__(self, cache_dir=None, max_bytes=MAX_BYTES):
+        """
+        Create a GradientCache object which stores gradient images in a directory,
+        the least recently used files are evicted above a size cap
+
+        :param cache_dir: directory of the cache, default gradients in the cache directory (cf. sed_cache_dir)
+        :param max_bytes: size cap of the cache in bytes
+        :type cache_dir: str
+        :type max_bytes: int
+        :build: a GradientCache with hits and misses counters set to 0
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(sed_cache_dir(), "gradients")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, in_image: np.ndarray, model_id: str) -> str:
+        """
+        Return the key of the gradient of the given image computed with the given model
+
+        :param in_image: The image data as array
+        :param model_id: identity of the model (cf. model_identity)
+        :type in_image: numpy.ndarray
+        :type model_id: str
+
+        :return: hexadecimal digest of the image content, shape, dtype and of the model identity
+        :rtype: str
+        """
+        in_image = np.ascontiguousarray(in_image)
+        digest = hashlib.sha1(f"{model_id}:{in_image.shape}:{in_image.dtype.str}".encode())
+        digest.update(in_image.data)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        Return the path of the file of the given key
+
+        :param key: key of a gradient (cf. key)
+        :type key: str
+
+        :return: path of the .npy file
+        :rtype: str
+        """
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key: str):
+        """
+        Return the cached gradient of the given key, memory mapped in read-only mode,
+        and mark it as recently used
+
+        :param key: key of a gradient (cf. key)
+        :type key: str
+
+        :return: the gradient, None if it is not cached
+        :rtype: numpy.memmap or None
+        """
+        path = self.path(key)
+        try:
+            gradient = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            with self._lock: self.misses += 1
+            return None
+
+        with self._lock: self.hits += 1
+        return gradient
+
+    def put(self, key: str, gradient: np.ndarray) -> None:
+        """
+        Store the given gradient as float32 then evict the least recently used
+        files above the size cap. The file is written aside then renamed so that
+        a concurrent reader never sees a partial file
+
+        :param key: key of the gradient (cf. key)
+        :param gradient: the gradient image
+        :type key: str
+        :type gradient: numpy.ndarray
+
+        :return: None
+        :rtype: None
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(gradient, dtype=np.float32))
+        os.replace(tmp_path, self.path(key))
+
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used files until the size of the cache is below the cap
+
+        :return: number of removed files
+        :rtype: int
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by another process
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return removed
+
+    def get_or_compute(self, in_image: np.ndarray, model_id: str, compute) -> np.ndarray:
+        """
+        Return the cached gradient of the given image, otherwise compute it and store it
+
+        :param in_image: The image data as array
+        :param model_id: identity of the model (cf. model_identity)
+        :param compute: function returning the gradient of in_image, only called on a miss
+        :type in_image: numpy.ndarray
+        :type model_id: str
+        :type compute: function
+
+        :return: the gradient image
+        :rtype: numpy.ndarray
+        """
+        key = self.key(in_image, model_id)
+        gradient = self.get(key)
+        if gradient is None:
+            gradient = np.asarray(compute(), dtype=np.float32)
+            self.put(key, gradient)
+        return gradient
+
+    def stats(self) -> dict:
+        """
+        Return the hits and misses counters
+
+        :return: number of hits and misses
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+def model_identity(model_path: str) -> str:
+    """
+    Return the identity of the given model file, from its path, size and modification time
+
+    :param model_path: path of the model file
+    :type model_path: str
+
+    :return: identity of the model
+    :rtype: str
+    """
+    stat = os.stat(model_path)
+    return f"{os.path.realpath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`image_loader` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Image Loader Module
+
+Decoding of the dataset images as uint8 (height,width,3) arrays, ahead of the segmentation
+in a bounded thread pool, optionally downscaled during the JPEG decoding
+
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+# default number of images decoded ahead
+PREFETCH = 4
+# default number of decoding threads
+WORKERS = 2
+
+def load_image(path: str, max_side=None) -> tuple:
+    """
+    Decode the given image as an RGB uint8 array (grayscale, palette and RGBA images are converted).
+    If max_side is given, the image is downscaled so that its largest side is at most max_side,
+    a JPEG image is first reduced by the decoder itself (DCT scaling by 1/2, 1/4 or 1/8)
+
+    :param path: path of the image
+    :param max_side: maximum side of the decoded image, None to keep the original size
+    :type path: str
+    :type max_side: int
+
+    :return: the image and the scale (decoded / original) along x and y, to apply to the groundtruth boxes
+    :rtype: tuple (numpy.ndarray of shape (height,width,3), tuple (float, float))
+
+    :UC: max_side > 0
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+
+        if max_side is not None and max(width, height) > max_side:
+            ratio = max_side / max(width, height)
+            # JPEG only, the decoder picks the largest DCT scale which keeps at least the requested size
+            img.draft("RGB", (int(width * ratio), int(height * ratio)))
+            img = img.convert("RGB")
+            img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+        else:
+            img = img.convert("RGB")
+
+        in_image = np.asarray(img, dtype=np.uint8)
+
+    return in_image, (in_image.shape[1] / width, in_image.shape[0] / height)
+
+def prefetch_images(paths, max_side=None, prefetch=PREFETCH, workers=WORKERS):
+    """
+    Decode the given images (cf. load_image) in a pool of threads, at most prefetch images
+    ahead of the consumer, and yield them in the order of the given paths
+
+    :param paths: paths of the images, can be a generator
+    :param max_side: maximum side of the decoded images, None to keep the original size
+    :param prefetch: maximum number of images decoded ahead
+    :param workers: number of decoding threads
+    :type paths: iterable of str
+    :type max_side: int
+    :type prefetch: int
+    :type workers: int
+
+    :return: path, image and scale of each image (cf. load_image)
+    :rtype: generator of tuple (str, numpy.ndarray, tuple (float, float))
+
+    :UC: prefetch > 0 and workers > 0
+    """
+    paths = iter(paths)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit() -> bool:
+            path = next(paths, None)
+            if path is None:
+                return False
+            pending.append((path, executor.submit(load_image, path, max_side)))
+            return True
+
+        while len(pending) < prefetch and submit():
+            pass
+
+        try:
+            while pending:
+                path, future = pending.popleft()
+                submit()
+                in_image, scale = future.result()
+                yield path, in_image, scale
+        finally: # the consumer may stop early
+            for _, future in pending:
+                future.cancel()
+
+def scale_boxes(boxes: np.ndarray, scale: tuple) -> np.ndarray:
+    """
+    Return the given boxes of the original image in the coordinates of the decoded image
+    (ex: the groundtruth boxes of a downscaled image)
+
+    :param boxes: xmin, ymin, xmax, ymax of each box in the original image
+    :param scale: scale (decoded / original) along x and y (cf. load_image)
+    :type boxes: numpy.ndarray of shape (n,4)
+    :type scale: tuple (float, float)
+
+    :return: the boxes in the decoded image
+    :rtype: numpy.ndarray of int64 of shape (n,4)
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if tuple(scale) == (1.0, 1.0):
+        return boxes
+
+    scale_x, scale_y = scale
+    return np.rint(boxes * np.array([scale_x, scale_y, scale_x, scale_y])).astype(np.int64)
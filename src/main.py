@@ -9,23 +9,72 @@
 Main Module
 """
 
+import os
+import sys
 import time
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    # headless run: non interactive backend, set before higra imports pyplot
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
 import numpy as np
 
 from bndbox import BndBox
-from segment_felzenszwalb import segment_felzenszwalb
+from segment_felzenszwalb import segment_felzenszwalb, colorize
 from segment_watershed import segment_watershed
+from proposals import reduce_proposals
+from image_loader import load_image, scale_boxes
+from xml_parser import parse_XML
+from dataset import annotation_path
+from render import render_segment
+
+# directory of the saved results, from the src directory
+RESULT_DIR = "../result"
 
 def usage():
-    print("USAGE\n\n- Felzenszwalb :\n\n\t$ python main.py [input_path] f [category] [gt_path]\n\n- Watershed:\n\n\t$ python main.py [input_path] w [category] [n_comp] [gt_path]\n")
+    print("USAGE\n\n- Felzenszwalb :\n\n\t$ python main.py [input_path] f [category] [gt_path]\n\n- Watershed:\n\n\t$ python main.py [input_path] w [category] [n_comp] [gt_path]\n\n- Batch :\n\n\t$ python main.py batch --help\n")
     print("input_path : image path to segment (ex: ../data/VOC2012_train_val/JPEGImages/person/XXXX.jpg)")
     print("category   : category of bounding box (ex: person, cat, bicycle, chair, ...)")
     print("n_comp     : only for watershed method, number of larger regions to retain in the hierachy, default 9 for the 10 most larger regions")
     print("gt_path    : path of the associated groundtruth wit the given input image, optional if you use VOC2012 dataset file tree (../data/VOC2012_train_val/Annotations/category/XXXX.xml)")
 
-def plot_segment(in_image: np.ndarray,input_path: str,output: np.ndarray,bb: BndBox,category: str,k="",method="felzenszwalb",save=True) -> None:
+def result_path(input_path: str,category: str,tag="",method="felzenszwalb") -> str:
+    """
+    Return the path where the result of the segmentation of the given image is saved
+
+    :param input_path: path of the original image
+    :param category: name of the category of the image
+    :param tag: parameter of the method which distinguishes the results (cf. result_tag)
+    :param method: segmentation method used : felzenszwalb or watershed
+    :type input_path: str
+    :type category: str
+    :type tag: str
+    :type method: str
+
+    :return: RESULT_DIR/category/method_tag_XXXX.jpg
+    :rtype: str
+    """
+    if tag != "": tag = str(tag) + "_"
+    return f"{RESULT_DIR}/{category}/{method}_{tag}{input_path.split('/')[-1]}"
+
+def result_tag(method: str,kwargs: dict,n_comp: int) -> str:
+    """
+    Return the parameter of the given method which distinguishes its results :
+    the threshold constant k for felzenszwalb, the number of regions n_comp for watershed
+
+    :param method: segmentation method used : felzenszwalb or watershed
+    :param kwargs: parameters of felzenszwalb (cf. segmentation)
+    :param n_comp: number of regions of watershed
+    :type method: str
+    :type kwargs: dict
+    :type n_comp: int
+
+    :return: the tag of the result (cf. result_path)
+    :rtype: str
+    """
+    return str(kwargs["k"]) if method == "felzenszwalb" else str(n_comp)
+
+def plot_segment(in_image: np.ndarray,input_path: str,output: np.ndarray,bb: BndBox,category: str,tag="",method="felzenszwalb",save=True) -> None:
     """
     
     Plot and save (in ../result/category/...) the original image with the red and green bounding box calculated from
@@ -33,10 +82,10 @@ def plot_segment(in_image: np.ndarray,input_path: str,output: np.ndarray,bb: Bnd
 
     :param in_image: The image data as array
     :param input_path: path of the original image
-    :param output: the segmented image
-    :param bb: BndBox object which contains the dict of bounding box calculated with assigned colors
+    :param output: the segmented image (label map for felzenszwalb)
+    :param bb: BndBox object which contains the bounding boxes calculated with assigned colors
     :param category: name of the category of the given in_image
-    :param k: threshold constant
+    :param tag: parameter of the method which distinguishes the results (cf. result_tag)
     :param method: indicate the segmentation method used : felzenszwalb or watershed
     :param save: True to save the plot, otherwise False
 
@@ -45,38 +94,42 @@ def plot_segment(in_image: np.ndarray,input_path: str,output: np.ndarray,bb: Bnd
     :type output: numpy.ndarray
     :type bb: BndBox
     :type category: str
-    :type k: str
+    :type tag: str
     :type method: str
     :type save: bool
 
     :return: None
     :rtype: None
     """
+    # imported here so that headless runs never load an interactive backend
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+
     fig = plt.figure()
 
     a = fig.add_subplot(1, 2, 1)
     plt.imshow(in_image)
     a.set_title('Original Image')
 
-    for comp in bb.get_bndbox_id():
-        pt = bb.get_bndbox(comp)
+    for (xmin, ymin, xmax, ymax), color in zip(bb.get_boxes().tolist(), bb.get_colors().tolist()):
 
-        rect = patches.Rectangle((2+(pt[0][0]%bb.w), 2+(pt[1][0]/bb.w)),
-                                 ((pt[0][1]%bb.w)-2) - (pt[0][0]%bb.w)+2,
-                                 ((pt[1][1]/bb.w)-2) - (pt[1][0]/bb.w),
-                linewidth=1.5, edgecolor=bb.get_bndbox_color(comp), facecolor='none')
+        rect = patches.Rectangle((2+xmin, 2+ymin),
+                                 (xmax-2) - xmin+2,
+                                 (ymax-2) - ymin,
+                linewidth=1.5, edgecolor=color, facecolor='none')
 
         a.add_patch(rect)
 
     a = fig.add_subplot(1, 2, 2)
+    if method == "felzenszwalb": output = colorize(output)
     plt.imshow(output.astype('uint8'))
     a.set_title(f'{method} segmentation'.capitalize())
-    if k != "": k = str(k) + "_"
-    if save: fig.savefig(f"../result/{category}/{method}_{k}{input_path.split('/')[-1]}")
+    if save: fig.savefig(result_path(input_path,category,tag=tag,method=method))
     
     plt.show()
+    plt.close(fig)
 
-def segmentation(input_path: str,method="felzenszwalb",kwargs={"sigma" : 0.5, "k" : 500, "min_size" : 50},n_comp=9,category="person",gt_path="",save=True,verbose=False) -> tuple:
+def segmentation(input_path: str,method="felzenszwalb",kwargs={"sigma" : 0.5, "k" : 500, "min_size" : 50},n_comp=9,category="person",gt_path="",save=True,verbose=False,reduce=False,annotations=None,plot=True,cache=None,stats=None,writer=None,image=None,max_side=None) -> tuple:
     """
 
     Perform the segmentation method given (felzenszwalb or watershed) on the given input image path
@@ -92,6 +145,17 @@ def segmentation(input_path: str,method="felzenszwalb",kwargs={"sigma" : 0.5, "k
     :param gt_path: path of the associated groundtruth wit the given input image
     :param save: True to save the result, otherwise False
     :param verbose: verbosity
+    :param reduce: True to remove duplicate and near duplicate bounding boxes before evaluation and plot (cf. reduce_proposals)
+    :param annotations: if given and gt_path is not, the groundtruths are looked up in this index instead of parsed from a file
+    :param plot: False to skip the plot (cf. plot_segment)
+    :param cache: only for watershed method, if given, cache of gradient images (cf. segment_watershed.sed_gradient)
+    :param stats: if given, filled with the time of each stage (decode_time, segment_time, eval_time) and the statistics of the segmentation
+    :param writer: if given, instead of the plot, the result is rendered without matplotlib (cf. render.render_segment)
+                   and saved by this writer in the background
+    :param image: if given, the image of input_path already decoded and its scale (cf. image_loader.load_image),
+                  ex: decoded ahead by image_loader.prefetch_images
+    :param max_side: if given and image is not, the image is downscaled at decoding so that its largest side
+                     is at most max_side, the groundtruth boxes are scaled accordingly
 
     :type input_path: str
     :type method: str
@@ -101,6 +165,14 @@ def segmentation(input_path: str,method="felzenszwalb",kwargs={"sigma" : 0.5, "k
     :type gt_path: str
     :type save: bool
     :type verbose: bool
+    :type reduce: bool
+    :type annotations: AnnotationIndex
+    :type plot: bool
+    :type cache: GradientCache
+    :type stats: dict
+    :type writer: render.ImageWriter
+    :type image: tuple (numpy.ndarray, tuple (float, float))
+    :type max_side: int
 
     :return: the BndBox object associated with the segmentation, the segmented image which allows to identify which region each pixel belongs to
     :rtype: tuple (BndBox, numpy.ndarray)
@@ -108,48 +180,75 @@ def segmentation(input_path: str,method="felzenszwalb",kwargs={"sigma" : 0.5, "k
     """
     assert(method in ["felzenszwalb", "watershed"])
 
-    in_image = plt.imread(input_path)
+    if stats is None: stats = {}
+
+    start_time = time.time()
+    if image is None: image = load_image(input_path,max_side=max_side)
+    in_image, scale = image
+    stats["decode_time"] = time.time() - start_time
 
     height, width, band = in_image.shape
     
     if verbose : print("Height:  " + str(height),"\nWidth:   " + str(width),end="\n")
 
     start_time = time.time()
-    
+
     # get output & bndbox from the segmentation used
     if method == "felzenszwalb":
         assert(band == 3)
-        output, bb = segment_felzenszwalb(in_image,**kwargs,height=height,width=width)
+        output, bb = segment_felzenszwalb(in_image,**kwargs,height=height,width=width,stats=stats)
     else:
         # switch to float to avoid numerical issue with uint8
         in_image = in_image.astype(np.float32)/255
-        output, bb = segment_watershed(in_image,height,width,n_comp=n_comp)
+        output, bb = segment_watershed(in_image,height,width,n_comp=n_comp,cache=cache)
 
     elapsed_time = time.time() - start_time
+    stats["segment_time"] = elapsed_time
 
     if verbose : print("Execution time: " + str(int(elapsed_time / 60))
                        + " minute(s) and " + str(int(elapsed_time % 60))
                        + " seconds",end="\n\n")
+    if verbose and "merges" in stats: print("Merges: " + str(stats["merges"]),
+                                            "\nSmall components merges: " + str(stats["small_merges"]),end="\n\n")
 
-    # ground thruth xml path
-    if gt_path == "": gt_path = "/".join(input_path.split('/')[:3]) + "/Annotations/" + category + "/" + input_path.split('/')[-1].rstrip(".jpg") + ".xml"
-    
-    # init dict and dataframe to eval bndbox & gt
-    bb.init_eval(gt_path,category)
+    if reduce:
+        bb = reduce_proposals(bb,stats=stats)
+        if verbose: print("Duplicate boxes removed: " + str(stats["duplicates"]),
+                          "\nNear duplicate boxes removed: " + str(stats["suppressed"]),end="\n\n")
+
+    start_time = time.time()
+
+    if gt_path == "" and annotations is not None:
+        # groundtruth boxes from the annotation index
+        gt_boxes = annotations.lookup(os.path.splitext(os.path.basename(input_path))[0],category)
+    else:
+        # ground thruth xml path
+        if gt_path == "": gt_path = annotation_path(input_path,category)
+        gt_boxes = parse_XML(gt_path,category)[["xmin","ymin","xmax","ymax"]].to_numpy(dtype=np.int64)
+
+    # init dict and dataframe to eval bndbox & gt, in the coordinates of the decoded image
+    bb.init_eval_boxes(scale_boxes(gt_boxes,scale),category)
 
     # start eval bndbox from gt
     bb.start_eval(verbose=False) # verbose=verbose/True to show all calculated overlap
+    stats["eval_time"] = time.time() - start_time
 
     # plot & save results
-    plot_segment(in_image,input_path,output,bb,category,k=kwargs['k'],method=method,save=save)
+    if writer is not None:
+        if save: writer.write(result_path(input_path,category,tag=result_tag(method,kwargs,n_comp),method=method),render_segment(in_image,output,bb))
+    elif plot:
+        plot_segment(in_image,input_path,output,bb,category,tag=result_tag(method,kwargs,n_comp),method=method,save=save)
 
     return bb, output
 
 if __name__ == "__main__":
-    import sys
     len_argv = len(sys.argv)
     
-    if (len_argv >= 4):
+    if (len_argv >= 2 and sys.argv[1] == "batch"):
+        from batch import batch_main
+        batch_main(sys.argv[2:])
+
+    elif (len_argv >= 4):
 
         input_path = sys.argv[1]
         method = sys.argv[2]
@@ -166,7 +265,7 @@ if __name__ == "__main__":
         elif method == "w": # watershed
             n_comp = 9
             if len_argv > 4:
-                n_comp = sys.argv[4]
+                n_comp = int(sys.argv[4])
             if len_argv > 5:
                 gt_path = sys.argv[5]
 
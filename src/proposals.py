@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`proposals` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Proposals Module
+
+Reduction of the bounding boxes proposed by one or several segmentations
+(several k values, felzenszwalb and watershed) before evaluation and plot:
+exact duplicates are removed, then near duplicates by non-maximum suppression
+
+"""
+
+import numpy as np
+
+from bndbox import *
+
+# default overlap above which a box is suppressed by a bigger one
+NMS_THRESHOLD = 0.9
+
+# number of boxes resolved together by nms
+NMS_BLOCK = 256
+
+def box_keys(boxes: np.ndarray) -> np.ndarray:
+    """
+    Pack the four coordinates of each box in one 64 bits integer,
+    two boxes are identical if and only if their keys are equal
+
+    :param boxes: xmin, ymin, xmax, ymax of each box
+    :type boxes: numpy.ndarray of shape (n,4)
+
+    :return: key of each box
+    :rtype: numpy.ndarray of uint64
+
+    :UC: 0 <= coordinates < 65536
+    """
+    boxes = np.asarray(boxes, dtype=np.uint64)
+    return (boxes[:, 0] << 48) | (boxes[:, 1] << 32) | (boxes[:, 2] << 16) | boxes[:, 3]
+
+def unique_boxes(boxes: np.ndarray) -> np.ndarray:
+    """
+    Return the rows of the given boxes without exact duplicates,
+    the first occurrence of each box is kept
+
+    :param boxes: xmin, ymin, xmax, ymax of each box
+    :type boxes: numpy.ndarray of shape (n,4)
+
+    :return: sorted rows of the kept boxes
+    :rtype: numpy.ndarray
+
+    :UC: 0 <= coordinates < 65536
+    """
+    _, first = np.unique(box_keys(boxes), return_index=True)
+    return np.sort(first)
+
+def nms(boxes: np.ndarray, scores=None, threshold=NMS_THRESHOLD, block=NMS_BLOCK) -> np.ndarray:
+    """
+    Greedy non-maximum suppression: by decreasing score, a box is kept if its overlap
+    (cf. iou_matrix) with every box kept before it is not above the threshold.
+
+    Boxes are resolved by blocks of sorted boxes: a block is first compared at once
+    with the boxes kept by the previous blocks, then the greedy choice inside the block
+    is propagated on its own overlap matrix until it is stable, which gives
+    the same boxes as visiting them one by one
+
+    :param boxes: xmin, ymin, xmax, ymax of each box
+    :param scores: score of each box, by default the area of the box
+    :param threshold: overlap above which a box is suppressed
+    :param block: number of boxes of a block
+    :type boxes: numpy.ndarray of shape (n,4)
+    :type scores: numpy.ndarray
+    :type threshold: float
+    :type block: int
+
+    :return: sorted rows of the kept boxes
+    :rtype: numpy.ndarray
+
+    :UC: 0 <= threshold <= 1
+    """
+    boxes = np.asarray(boxes, dtype=np.int64)
+    if scores is None:
+        scores = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    # stable order, the first box wins a tie
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    keep = np.zeros(shape=0, dtype=np.int64)
+
+    for start in range(0, order.shape[0], block):
+        candidates = order[start:start + block]
+
+        # suppressed by a box of a previous block
+        alive = np.ones(shape=candidates.shape[0], dtype=bool)
+        for first in range(0, keep.shape[0], 16 * block):
+            alive &= ~(iou_matrix(boxes[keep[first:first + 16 * block]], boxes[candidates]) > threshold).any(axis=0)
+        candidates = candidates[alive]
+
+        # suppressed[i, j] if box i comes before box j and suppresses it when kept
+        suppressed = np.triu(iou_matrix(boxes[candidates], boxes[candidates]) > threshold, k=1)
+        kept = np.ones(shape=candidates.shape[0], dtype=bool)
+        while True:
+            new_kept = ~(suppressed & kept[:, None]).any(axis=0)
+            if np.array_equal(new_kept, kept):
+                break
+            kept = new_kept
+
+        keep = np.concatenate((keep, candidates[kept]))
+
+    return np.sort(keep)
+
+def reduce_proposals(bb: BndBox, threshold=NMS_THRESHOLD, stats=None) -> BndBox:
+    """
+    Remove the exact duplicates (cf. unique_boxes) then the near duplicates (cf. nms)
+    of the bounding boxes of the given BndBox object
+
+    :param bb: the bounding boxes to reduce
+    :param threshold: overlap above which a box is suppressed, None to only remove exact duplicates
+    :param stats: if given, filled with the number of boxes removed by each step (duplicates, suppressed)
+    :type bb: BndBox
+    :type threshold: float
+    :type stats: dict
+
+    :return: the kept bounding boxes
+    :rtype: BndBox
+    """
+    rows = unique_boxes(bb.get_boxes())
+    n_unique = rows.shape[0]
+
+    if threshold is not None:
+        rows = rows[nms(bb.get_boxes()[rows], threshold=threshold)]
+
+    if stats is not None:
+        stats["duplicates"] = bb.get_nb_bndbox() - n_unique
+        stats["suppressed"] = n_unique - rows.shape[0]
+
+    return bb.subset(rows)
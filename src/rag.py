@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`RAG` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Region Adjacency Graph Module
+
+"""
+
+import numpy as np
+
+class RAG:
+    """
+    Create a RAG object to represent the region adjacency graph of a segmentation,
+    the neighbours of each region are stored in compressed sparse rows (CSR)
+    """
+    def __init__(self, label: np.ndarray, edges: np.ndarray, boundary_length: np.ndarray, mean_gradient=None):
+        """
+        Create a RAG object to represent the region adjacency graph of a segmentation,
+        the neighbours of each region are stored in compressed sparse rows (CSR)
+
+        :param label: sorted region ids, a region is designated by its row in label
+        :param edges: pairs (i, j) of adjacent regions with i < j
+        :param boundary_length: number of 4-adjacent pixel pairs on the boundary of each edge
+        :param mean_gradient: mean gradient along the boundary of each edge
+        :type label: numpy.ndarray
+        :type edges: numpy.ndarray of shape (e,2)
+        :type boundary_length: numpy.ndarray
+        :type mean_gradient: numpy.ndarray
+        :build: a RAG with its CSR arrays indptr, indices (neighbour of each entry)
+                and edge_index (row in edges of each entry)
+        """
+        self.label = label
+        self.edges = edges
+        self.boundary_length = boundary_length
+        self.mean_gradient = mean_gradient
+
+        n_regions, n_edges = label.shape[0], edges.shape[0]
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+        order = np.lexsort((dst, src))
+
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n_regions))))
+        self.indices = dst[order]
+        self.edge_index = np.concatenate((np.arange(n_edges), np.arange(n_edges)))[order]
+
+    def get_nb_regions(self) -> int:
+        """
+        Return the number of regions
+
+        :return: number of regions
+        :rtype: int
+
+        :UC: None
+        """
+        return self.label.shape[0]
+
+    def get_nb_edges(self) -> int:
+        """
+        Return the number of pairs of adjacent regions
+
+        :return: number of edges
+        :rtype: int
+
+        :UC: None
+        """
+        return self.edges.shape[0]
+
+    def neighbours(self, i: int) -> np.ndarray:
+        """
+        Return the sorted neighbours of the given region
+
+        :param i: row of the region in label
+        :type i: int
+
+        :return: rows of the adjacent regions
+        :rtype: numpy.ndarray
+
+        :UC: 0 <= i < self.get_nb_regions()
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def neighbour_edges(self, i: int) -> np.ndarray:
+        """
+        Return the edges between the given region and its neighbours,
+        in the order of neighbours(i)
+
+        :param i: row of the region in label
+        :type i: int
+
+        :return: rows of the edges in edges
+        :rtype: numpy.ndarray
+
+        :UC: 0 <= i < self.get_nb_regions()
+        """
+        return self.edge_index[self.indptr[i]:self.indptr[i + 1]]
+
+def region_adjacency_graph(labels: np.ndarray, gradient=None) -> RAG:
+    """
+    Build the region adjacency graph of the given label map (felzenszwalb or watershed
+    segmentation) by comparing the label map with itself shifted by one pixel
+    to the right and to the bottom
+
+    :param labels: label map of the segmentation
+    :param gradient: if given, the gradient of each pair of boundary pixels is the mean of their values
+                     for a (height,width) gradient image, or their colour distance for a (height,width,3) image
+    :type labels: numpy.ndarray of shape (height,width)
+    :type gradient: numpy.ndarray
+
+    :return: the region adjacency graph, with mean_gradient if gradient is given
+    :rtype: RAG
+    """
+    label, index = np.unique(labels.ravel(), return_inverse=True)
+    n_regions = label.shape[0]
+    index = index.reshape(labels.shape)
+
+    first = np.concatenate((index[:, :-1].ravel(), index[:-1, :].ravel()))
+    second = np.concatenate((index[:, 1:].ravel(), index[1:, :].ravel()))
+    boundary = first != second
+    first, second = first[boundary], second[boundary]
+
+    # one key for each unordered pair of regions
+    key = np.minimum(first, second).astype(np.int64) * n_regions + np.maximum(first, second)
+    key, pair, boundary_length = np.unique(key, return_inverse=True, return_counts=True)
+    edges = np.stack(np.divmod(key, n_regions), axis=1)
+
+    mean_gradient = None
+    if gradient is not None:
+        gradient = np.asarray(gradient, dtype=np.float64)
+        if gradient.ndim == 3:
+            pair_gradient = np.concatenate((np.linalg.norm(gradient[:, :-1] - gradient[:, 1:], axis=2).ravel(),
+                                            np.linalg.norm(gradient[:-1, :] - gradient[1:, :], axis=2).ravel()))
+        else:
+            pair_gradient = np.concatenate((((gradient[:, :-1] + gradient[:, 1:]) / 2).ravel(),
+                                            ((gradient[:-1, :] + gradient[1:, :]) / 2).ravel()))
+        mean_gradient = np.bincount(pair, weights=pair_gradient[boundary], minlength=key.shape[0]) / boundary_length
+
+    return RAG(label, edges, boundary_length, mean_gradient)
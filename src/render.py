@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`render` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Render Module
+
+Headless rendering of a segmentation result straight into uint8 arrays (no matplotlib),
+written to disk by a background thread
+
+"""
+
+import atexit
+import os
+import queue
+import threading
+import numpy as np
+from PIL import Image
+
+from bndbox import BndBox
+from segment_felzenszwalb import colorize
+
+# RGB value of the colors assigned to the bounding boxes
+COLORS = {"r": (255, 0, 0), "g": (0, 255, 0)}
+
+def draw_boxes(in_image: np.ndarray, boxes: np.ndarray, colors, thickness=1) -> np.ndarray:
+    """
+    Return a copy of the given image with the outline of each given box,
+    every outline pixel of every box is painted in one indexed assignment per side
+
+    :param in_image: The image data as array, uint8 or float in [0,1]
+    :param boxes: xmin, ymin, xmax, ymax of each box
+    :param colors: color of each box, r, g or RGB values
+    :param thickness: thickness of the outlines in pixels, drawn inside the boxes
+    :type in_image: numpy.ndarray of shape (height,width,3)
+    :type boxes: numpy.ndarray of shape (n,4)
+    :type colors: iterable
+    :type thickness: int
+
+    :return: the image with the boxes, the last boxes are drawn over the first ones
+    :rtype: numpy.ndarray of uint8 of shape (height,width,3)
+    """
+    out = to_uint8(in_image).copy()
+    height, width = out.shape[:2]
+
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    rgb = np.array([COLORS[c] if isinstance(c, str) else c for c in colors], dtype=np.uint8).reshape(-1, 3)
+
+    # boxes clipped to the image
+    xmin, ymin = np.clip(boxes[:, 0], 0, width - 1), np.clip(boxes[:, 1], 0, height - 1)
+    xmax, ymax = np.clip(boxes[:, 2], 0, width - 1), np.clip(boxes[:, 3], 0, height - 1)
+
+    for t in range(thickness):
+        valid = np.flatnonzero((xmin + t <= xmax - t) & (ymin + t <= ymax - t))
+        x0, y0, x1, y1 = xmin[valid] + t, ymin[valid] + t, xmax[valid] - t, ymax[valid] - t
+
+        # horizontal sides (top then bottom) and vertical sides (left then right)
+        for fixed, start, end, horizontal in ((y0, x0, x1, True), (y1, x0, x1, True),
+                                              (x0, y0, y1, False), (x1, y0, y1, False)):
+            length = end - start + 1
+            along = np.repeat(start, length) + np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length)
+            across = np.repeat(fixed, length)
+            if horizontal:
+                out[across, along] = np.repeat(rgb[valid], length, axis=0)
+            else:
+                out[along, across] = np.repeat(rgb[valid], length, axis=0)
+
+    return out
+
+def render_segment(in_image: np.ndarray, output: np.ndarray, bb: BndBox, thickness=1) -> np.ndarray:
+    """
+    Render side by side the original image with the bounding boxes and their assigned colors,
+    and the colorized label map of the segmentation (cf. main.plot_segment)
+
+    :param in_image: The image data as array, uint8 or float in [0,1]
+    :param output: label map of the segmentation
+    :param bb: BndBox object which contains the bounding boxes calculated with assigned colors
+    :param thickness: thickness of the box outlines in pixels
+    :type in_image: numpy.ndarray of shape (height,width,3)
+    :type output: numpy.ndarray of shape (height,width)
+    :type bb: BndBox
+    :type thickness: int
+
+    :return: the rendered picture
+    :rtype: numpy.ndarray of uint8 of shape (height,2*width,3)
+    """
+    boxes = draw_boxes(in_image, bb.get_boxes(), bb.get_colors().tolist(), thickness=thickness)
+    return np.concatenate((boxes, colorize(output, seed=0)), axis=1)
+
+def to_uint8(in_image: np.ndarray) -> np.ndarray:
+    """
+    Return the given image as uint8, a float image is expected in [0,1]
+
+    :param in_image: The image data as array
+    :type in_image: numpy.ndarray
+
+    :return: the uint8 image
+    :rtype: numpy.ndarray of uint8
+    """
+    if np.issubdtype(in_image.dtype, np.floating):
+        return (np.clip(in_image, 0, 1) * 255 + 0.5).astype(np.uint8)
+    return in_image.astype(np.uint8, copy=False)
+
+class ImageWriter:
+    """
+    Create an ImageWriter object which encodes and writes images in a background thread,
+    at most max_pending images wait in its queue (write blocks above).
+    Use it as a context manager or close it, the queued images are also written at exit
+    """
+    def __init__(self, max_pending=8):
+        """
+        Create an ImageWriter object which encodes and writes images in a background thread,
+        at most max_pending images wait in its queue (write blocks above)
+
+        :param max_pending: maximum number of images waiting to be written
+        :type max_pending: int
+        :build: an ImageWriter with its writing thread started
+        """
+        self.written = 0
+        self.errors = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        # daemon so that a writer which is not closed never blocks the exit of the interpreter,
+        # its queued images are written at exit
+        self._thread = threading.Thread(target=self._run, name="ImageWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, path: str, image: np.ndarray) -> None:
+        """
+        Queue the given image to be written in the given path (format from the extension),
+        the directory is created if needed
+
+        :param path: path of the image file
+        :param image: the image
+        :type path: str
+        :type image: numpy.ndarray of uint8
+
+        :return: None
+        :rtype: None
+        """
+        self._queue.put((path, image))
+
+    def close(self) -> None:
+        """
+        Wait until every queued image is written and stop the writing thread
+
+        :return: None
+        :rtype: None
+        """
+        atexit.unregister(self.close)
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self) -> None:
+        """
+        Write the queued images until close
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            path, image = item
+            try:
+                directory = os.path.dirname(path)
+                if directory: os.makedirs(directory, exist_ok=True)
+                Image.fromarray(image).save(path)
+                self.written += 1
+            except Exception as error: # keep writing the next images
+                self.errors.append((path, error))
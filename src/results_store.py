@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`results_store` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Results Store Module
+
+Append-only columnar store of the evaluation results, one row per
+(image, category, method, parameters): each column is a file to which the rows
+are appended (one line per row for text columns, raw values for numeric columns),
+and the MABO of each (category, method, parameters) is kept up to date as rows arrive
+
+"""
+
+import json
+import os
+import numpy as np
+
+# text columns, one line per row
+TEXT_COLUMNS = ("key", "image_id", "category", "method", "params")
+# numeric columns, raw values
+NUMERIC_COLUMNS = {
+    "abo": np.float64,
+    "n_regions": np.int64,
+    "decode_time": np.float64,
+    "segment_time": np.float64,
+    "eval_time": np.float64,
+    "total_time": np.float64,
+}
+
+class ResultsStore:
+    """
+    Create a ResultsStore object to append rows to the columns of a store directory
+    and to follow the MABO of each (category, method, parameters).
+
+    A store has a single writer, parallel workers (cf. batch) each write their own store
+    which are then merged (cf. merge)
+    """
+    def __init__(self, store_dir: str, readonly=False):
+        """
+        Create a ResultsStore object to append rows to the columns of a store directory
+        and to follow the MABO of each (category, method, parameters)
+
+        :param store_dir: directory of the store, created if needed unless readonly
+        :param readonly: True to only read the store, its files are left untouched
+                         and the rows of an interrupted append are ignored
+        :type store_dir: str
+        :type readonly: bool
+        :build: a ResultsStore whose running MABO are computed once from the stored rows,
+                the rows of an interrupted append are dropped
+
+        :raise FileNotFoundError: if readonly and the store directory does not exist
+        """
+        self.store_dir = store_dir
+        self.readonly = readonly
+        if readonly:
+            if not os.path.isdir(store_dir):
+                raise FileNotFoundError(f"results store not found : {store_dir}")
+        else:
+            os.makedirs(store_dir, exist_ok=True)
+        self._files = {}
+
+        self.n_rows = self._count_rows()[0] if readonly else self._repair()
+        self._keys = set(self._read_text("key"))
+
+        # running sum of ABO and number of rows of each (category, method, params)
+        self._sums = {}
+        if self.n_rows:
+            groups = list(zip(self._read_text("category"), self._read_text("method"), self._read_text("params")))
+            for group, abo in zip(groups, self._read_numeric("abo").tolist()):
+                self._add(group, abo)
+
+    def __len__(self) -> int:
+        """
+        Return the number of rows
+
+        :return: number of rows
+        :rtype: int
+        """
+        return self.n_rows
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Return True if a row of the given key is stored
+
+        :param key: key of a row
+        :type key: str
+
+        :return: True if the row is stored
+        :rtype: bool
+        """
+        return key in self._keys
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, row: dict) -> bool:
+        """
+        Append the given row to the columns, unless a row of the same key is stored,
+        and update the MABO of its (category, method, params)
+
+        :param row: value of each column (cf. TEXT_COLUMNS and NUMERIC_COLUMNS), params is a dict,
+                    a missing numeric value is stored as NaN (-1 for n_regions)
+        :type row: dict
+
+        :return: True if the row is appended
+        :rtype: bool
+
+        :UC: the text values don't contain new lines, the store is not readonly
+        """
+        if self.readonly:
+            raise ValueError(f"results store opened readonly : {self.store_dir}")
+        if row["key"] in self._keys:
+            return False
+
+        params = row["params"] if isinstance(row["params"], str) else json.dumps(row["params"], sort_keys=True)
+        text = dict(row, params=params)
+
+        for name in TEXT_COLUMNS:
+            self._file(name).write((str(text[name]) + "\n").encode())
+        for name, dtype in NUMERIC_COLUMNS.items():
+            default = -1 if np.issubdtype(dtype, np.integer) else np.nan
+            self._file(name).write(np.array([row.get(name, default)], dtype=dtype).tobytes())
+        for f in self._files.values():
+            f.flush()
+
+        self._keys.add(row["key"])
+        self.n_rows += 1
+        self._add((row["category"], row["method"], params), float(row["abo"]))
+
+        return True
+
+    def columns(self, names=None) -> dict:
+        """
+        Return the given columns, numeric columns are memory mapped
+
+        :param names: names of the columns, default every column
+        :type names: list of str
+
+        :return: values of each column
+        :rtype: dict of numpy.ndarray
+        """
+        if names is None:
+            names = TEXT_COLUMNS + tuple(NUMERIC_COLUMNS)
+
+        return {name: self._read_numeric(name) if name in NUMERIC_COLUMNS else np.array(self._read_text(name))
+                for name in names}
+
+    def mabo(self, category=None, method=None) -> dict:
+        """
+        Return the running MABO (mean of the ABO of the images) of each (category, method, params)
+
+        :param category: if given, only the groups of this category
+        :param method: if given, only the groups of this method
+        :type category: str
+        :type method: str
+
+        :return: MABO and number of images of each (category, method, params), params as a json string
+        :rtype: dict of tuple (float, int)
+        """
+        return {group: (total / count, count) for group, (total, count) in self._sums.items()
+                if (category is None or group[0] == category) and (method is None or group[1] == method)}
+
+    def mabo_curve(self, category: str, method: str, param: str) -> tuple:
+        """
+        Return the MABO of the given category and method as a function of the given parameter
+        (ex: k for felzenszwalb, n_comp for watershed), to plot mabo_<category>.png from a partial run
+
+        :param category: category of the images
+        :param method: segmentation method
+        :param param: name of the parameter
+        :type category: str
+        :type method: str
+        :type param: str
+
+        :return: sorted values of the parameter and MABO for each value
+        :rtype: tuple (numpy.ndarray, numpy.ndarray)
+        """
+        points = sorted((json.loads(params)[param], mabo) for (_, _, params), (mabo, _) in self.mabo(category, method).items())
+        return np.array([x for x, _ in points]), np.array([y for _, y in points])
+
+    def merge(self, other_dir: str) -> int:
+        """
+        Append the rows of another store (ex: a shard of a parallel run) whose key is not stored,
+        the other store is only read
+
+        :param other_dir: directory of the other store
+        :type other_dir: str
+
+        :return: number of appended rows
+        :rtype: int
+
+        :raise FileNotFoundError: if the other store directory does not exist
+        :UC: the store is not readonly
+        """
+        other = ResultsStore(other_dir, readonly=True)
+        columns = other.columns()
+        other.close()
+
+        # first row of each key which is not stored
+        keys = columns["key"].tolist()
+        first = {}
+        for i, key in enumerate(keys):
+            if key not in self._keys and key not in first:
+                first[key] = i
+        new = np.array(sorted(first.values()), dtype=np.int64)
+        if new.shape[0] == 0:
+            return 0
+
+        # append every column at once
+        for name in TEXT_COLUMNS:
+            self._file(name).write("".join(value + "\n" for value in columns[name][new].tolist()).encode())
+        for name in NUMERIC_COLUMNS:
+            self._file(name).write(np.ascontiguousarray(columns[name][new]).tobytes())
+        for f in self._files.values():
+            f.flush()
+
+        self._keys.update(first)
+        self.n_rows += new.shape[0]
+        for category, method, params, abo in zip(columns["category"][new].tolist(), columns["method"][new].tolist(),
+                                                 columns["params"][new].tolist(), columns["abo"][new].tolist()):
+            self._add((category, method, params), abo)
+
+        return new.shape[0]
+
+    def close(self) -> None:
+        """
+        Close the column files
+
+        :return: None
+        :rtype: None
+        """
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _add(self, group: tuple, abo: float) -> None:
+        """
+        Add the given ABO to the running sum of the given group
+        """
+        total, count = self._sums.get(group, (0.0, 0))
+        self._sums[group] = (total + abo, count + 1)
+
+    def _path(self, name: str) -> str:
+        """
+        Return the path of the file of the given column
+        """
+        return os.path.join(self.store_dir, name + (".txt" if name in TEXT_COLUMNS else ".bin"))
+
+    def _file(self, name: str):
+        """
+        Return the file of the given column, opened in append mode
+        """
+        if self.readonly:
+            raise ValueError(f"results store opened readonly : {self.store_dir}")
+        if name not in self._files:
+            self._files[name] = open(self._path(name), "ab")
+        return self._files[name]
+
+    def _read_text(self, name: str) -> list:
+        """
+        Return the values of the given text column
+        """
+        if not os.path.exists(self._path(name)):
+            return []
+        with open(self._path(name), "rb") as f:
+            return f.read().decode().splitlines()[:self.n_rows]
+
+    def _read_numeric(self, name: str) -> np.ndarray:
+        """
+        Return the values of the given numeric column, memory mapped
+        """
+        dtype = NUMERIC_COLUMNS[name]
+        if self.n_rows == 0:
+            return np.zeros(shape=0, dtype=dtype)
+        # mapped up to the complete rows, a readonly store may end with a partial value
+        return np.memmap(self._path(name), dtype=dtype, mode="r", shape=(self.n_rows,))
+
+    def _count_rows(self) -> tuple:
+        """
+        Return the number of complete rows, the shortest column, without modifying the files
+
+        :return: number of complete rows and number of complete values of each column
+        :rtype: tuple (int, dict)
+        """
+        lengths = {}
+        for name in TEXT_COLUMNS:
+            path = self._path(name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    lengths[name] = f.read().count(b"\n")
+            else:
+                lengths[name] = 0
+        for name, dtype in NUMERIC_COLUMNS.items():
+            path = self._path(name)
+            lengths[name] = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+
+        return min(lengths.values()), lengths
+
+    def _repair(self) -> int:
+        """
+        Truncate every column to the number of complete rows, which drops the end
+        of an interrupted append
+
+        :return: number of complete rows
+        :rtype: int
+        """
+        n_rows, lengths = self._count_rows()
+
+        for name in TEXT_COLUMNS:
+            if lengths[name] > n_rows:
+                with open(self._path(name), "rb") as f:
+                    lines = f.read().split(b"\n")[:n_rows]
+                with open(self._path(name), "wb") as f:
+                    f.write(b"".join(line + b"\n" for line in lines))
+            elif os.path.exists(self._path(name)):
+                # a partial last line without new line
+                with open(self._path(name), "rb") as f:
+                    data = f.read()
+                if data and not data.endswith(b"\n"):
+                    with open(self._path(name), "wb") as f:
+                        f.write(data[:data.rfind(b"\n") + 1])
+        for name, dtype in NUMERIC_COLUMNS.items():
+            if os.path.exists(self._path(name)):
+                os.truncate(self._path(name), n_rows * np.dtype(dtype).itemsize)
+
+        return n_rows
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "merge":
+        with ResultsStore(sys.argv[2]) as store:
+            for other_dir in sys.argv[3:]:
+                print(f"{other_dir} : {store.merge(other_dir)} rows appended")
+            print(f"{len(store)} rows")
+    else:
+        print("USAGE\n\n\t$ python results_store.py merge [store_dir] [other_store_dir ...]\n")
+        print("store_dir       : directory of the store to which the rows are appended")
+        print("other_store_dir : directories of the stores to merge (ex: shards of a batch)")
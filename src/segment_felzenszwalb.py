@@ -13,14 +13,23 @@ Segment Felzenszwalb Module
 """
 
 import math
+import os
+import tempfile
+import time
 import numpy as np
-import random
 
-from universe import *
+from disjoint_set import *
 from filter import *
 from bndbox import *
 
-def segment_felzenszwalb(in_image: np.ndarray, sigma: float, k: int, min_size: int,height: int,width: int) -> tuple:
+# record of an edge in the sorted runs of the tiled segmentation,
+# d is the direction of the edge (0: right, 1: down, 2: down-right, 3: up-right)
+RUN_DTYPE = np.dtype([("a", np.int32), ("b", np.int32), ("w", np.float32), ("d", np.uint8)])
+
+# largest dissimilarity between two 8-bit RGB pixels
+MAX_DIFF = math.sqrt(3) * 255
+
+def segment_felzenszwalb(in_image: np.ndarray, sigma: float, k: int, min_size: int,height: int,width: int,stats=None,levels=None,max_weight=None) -> tuple:
     """
     Performs a complete felzenszwalb segmentation and calculate
     bounding box obtained from the segmentation
@@ -33,120 +42,564 @@ def segment_felzenszwalb(in_image: np.ndarray, sigma: float, k: int, min_size: i
     :param min_size:  minimum component size (enforced by post-processing stage)
     :param height: height of the image to segment
     :param width: width of the image to segment
+    :param stats: if given, filled with the sort time in seconds (sort_time), the number of merges of the segmentation (merges) and of the post-processing stage (small_merges)
+    :param levels: if given, edges are sorted on their weight quantized to this number of levels (cf. sort_edges)
+    :param max_weight: upper bound of the quantized weights, default the largest weight of the image (cf. quantize_weights)
     :type in_image: numpy.array
     :type sigma: float
     :type k: int
     :type min_size: int
     :type height: int
     :type width: int
+    :type stats: dict
+    :type levels: int
+    :type max_weight: float
+
+    :return: the label map (component id of each pixel) and the the associated BndBox object of this segmentation
+    :rtype: tuple (numpy.ndarray of int32, BndBox)
+
+    :UC: in_image must be of shape (height,width,3)
+    """
+    edges = _sorted_graph(in_image, sigma, height, width, levels, stats, max_weight)
+
+    return _segment_sorted_graph(edges, k, min_size, height, width, stats)
+
+def segment_felzenszwalb_sweep(in_image: np.ndarray, sigma: float, params: list, height: int, width: int, stats=None, levels=None, max_weight=None) -> list:
+    """
+    Performs one felzenszwalb segmentation for each given (k, min_size) setting,
+    the image is smoothed and the graph is built and sorted only once,
+    then only the merge and the post-processing stage run for each setting
+
+    :param in_image: The image data as array
+    :param sigma: value of gaussian filter to smooth the image
+    :param params: list of (k, min_size) settings
+    :param height: height of the image to segment
+    :param width: width of the image to segment
+    :param stats: if given, one dict of sort time and merge numbers (cf. segment_felzenszwalb) is appended for each setting
+    :param levels: if given, edges are sorted on their weight quantized to this number of levels (cf. sort_edges)
+    :param max_weight: upper bound of the quantized weights, default the largest weight of the image (cf. quantize_weights)
+    :type in_image: numpy.array
+    :type sigma: float
+    :type params: list of tuple (int, int)
+    :type height: int
+    :type width: int
+    :type stats: list
+    :type levels: int
+    :type max_weight: float
 
-    :return: the segmented image and the the associated BndBox object of this segmentation
-    :rtype: tuple (numpy.array, BndBox)
+    :return: the label map and the associated BndBox object of each setting, in the order of params
+    :rtype: list of tuple (numpy.ndarray of int32, BndBox)
 
     :UC: in_image must be of shape (height,width,3)
     """
-    smooth_red_band = smooth(in_image[:, :, 0], sigma)
-    smooth_green_band = smooth(in_image[:, :, 1], sigma)
-    smooth_blue_band = smooth(in_image[:, :, 2], sigma)
+    graph_stats = {}
+    edges = _sorted_graph(in_image, sigma, height, width, levels, graph_stats, max_weight)
+
+    results = []
+    for k, min_size in params:
+        setting_stats = dict(graph_stats) if stats is not None else None
+        results.append(_segment_sorted_graph(edges, k, min_size, height, width, setting_stats))
+        if stats is not None:
+            stats.append(setting_stats)
+
+    return results
+
+def _sorted_graph(in_image: np.ndarray, sigma: float, height: int, width: int, levels=None, stats=None, max_weight=None) -> tuple:
+    """
+    Smooth the image then build its graph with edges sorted by weight
+
+    :param in_image: The image data as array
+    :param sigma: value of gaussian filter to smooth the image
+    :param height: height of the image
+    :param width: width of the image
+    :param levels: number of quantization levels of the weights to sort on (cf. sort_edges)
+    :param stats: if given, filled with the sort time in seconds (sort_time)
+    :param max_weight: upper bound of the quantized weights (cf. quantize_weights)
+    :type in_image: numpy.array
+    :type sigma: float
+    :type height: int
+    :type width: int
+    :type levels: int
+    :type stats: dict
+    :type max_weight: float
+
+    :return: the sorted edges (cf. sort_edges)
+    :rtype: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    smooth_image = smooth(in_image, sigma)
+    smooth_red_band = smooth_image[:, :, 0]
+    smooth_green_band = smooth_image[:, :, 1]
+    smooth_blue_band = smooth_image[:, :, 2]
 
     # build graph
-    edges_size = width * height * 4
-    edges = np.zeros(shape=(edges_size, 3), dtype=object)
-    num = 0
-    for y in range(height):
-        for x in range(width):
-            if x < width - 1:
-                edges[num, 0] = int(y * width + x)
-                edges[num, 1] = int(y * width + (x + 1))
-                edges[num, 2] = diff(smooth_red_band, smooth_green_band, smooth_blue_band, x, y, x + 1, y)
-                num += 1
-            if y < height - 1:
-                edges[num, 0] = int(y * width + x)
-                edges[num, 1] = int((y + 1) * width + x)
-                edges[num, 2] = diff(smooth_red_band, smooth_green_band, smooth_blue_band, x, y, x, y + 1)
-                num += 1
-
-            if (x < width - 1) and (y < height - 2):
-                edges[num, 0] = int(y * width + x)
-                edges[num, 1] = int((y + 1) * width + (x + 1))
-                edges[num, 2] = diff(smooth_red_band, smooth_green_band, smooth_blue_band, x, y, x + 1, y + 1)
-                num += 1
-
-            if (x < width - 1) and (y > 0):
-                edges[num, 0] = int(y * width + x)
-                edges[num, 1] = int((y - 1) * width + (x + 1))
-                edges[num, 2] = diff(smooth_red_band, smooth_green_band, smooth_blue_band, x, y, x + 1, y - 1)
-                num += 1
+    edges_a, edges_b, weights = build_graph(smooth_red_band, smooth_green_band, smooth_blue_band, height, width)
+
+    start_time = time.time()
+    edges = sort_edges(edges_a, edges_b, weights, levels, max_weight)
+    if stats is not None:
+        stats["sort_time"] = time.time() - start_time
+
+    return edges
+
+def _segment_sorted_graph(edges: tuple, k: int, min_size: int, height: int, width: int, stats=None) -> tuple:
+    """
+    Segment the image from its sorted graph and calculate the bounding boxes
+
+    :param edges: the sorted edges (cf. _sorted_graph)
+    :param k: constant for threshold function
+    :param min_size:  minimum component size (enforced by post-processing stage)
+    :param height: height of the image
+    :param width: width of the image
+    :param stats: if given, filled with the number of merges (cf. segment_felzenszwalb)
+    :type edges: tuple
+    :type k: int
+    :type min_size: int
+    :type height: int
+    :type width: int
+    :type stats: dict
+
+    :return: the label map and the associated BndBox object
+    :rtype: tuple (numpy.ndarray of int32, BndBox)
+    """
+    edges_a, edges_b, weights = edges
+
     # Segment
-    u = segment_graph(width * height, num, edges, k)
+    u = segment_graph(width * height, edges_a, edges_b, weights, k)
+    num_merges = width * height - u.num_sets()
 
     # post process small components
-    for i in range(num):
-        a = u.find(edges[i, 0])
-        b = u.find(edges[i, 1])
-        if (a != b) and ((u.size(a) < min_size) or (u.size(b) < min_size)):
-            u.join(a, b)
+    num_small_merges = merge_small_components(u, edges_a, edges_b, min_size)
+
+    if stats is not None:
+        stats["merges"] = num_merges
+        stats["small_merges"] = num_small_merges
+
+    return _label_forest(u, height, width)
+
+def segment_felzenszwalb_tiled(in_image: np.ndarray, sigma: float, k: int, min_size: int, height: int, width: int, tile_size=512, overlap=None, stats=None) -> tuple:
+    """
+    Performs a felzenszwalb segmentation tile by tile to bound the memory
+    used by large images, and calculate bounding box obtained from the segmentation
+
+    Each tile is smoothed with overlap extra pixels of context around it, then the
+    edges starting from its pixels (including the ones crossing the tile seams) are built,
+    sorted and written to a temporary file. The sorted runs of all tiles are then
+    streamed in global weight order into the merge and the post-processing stage,
+    so that seam edges are merged with the same threshold rule as the others,
+    at the same place as in a full-image run.
+
+    With the default overlap, the labels and bounding boxes are the ones of
+    segment_felzenszwalb, a smaller overlap gives an approximate smoothing near the seams.
+    Apart from the per-pixel forest and label map, memory is proportional to the tile size.
+
+    :param in_image: The image data as array
+    :param sigma: value of gaussian filter to smooth the image
+    :param k: constant for threshold function
+    :param min_size:  minimum component size (enforced by post-processing stage)
+    :param height: height of the image to segment
+    :param width: width of the image to segment
+    :param tile_size: side of the tiles in pixels
+    :param overlap: pixels of context around each tile, by default the width of the smoothing
+    :param stats: if given, filled with the number of tiles and merges (cf. segment_felzenszwalb)
+    :type in_image: numpy.array
+    :type sigma: float
+    :type k: int
+    :type min_size: int
+    :type height: int
+    :type width: int
+    :type tile_size: int
+    :type overlap: int
+    :type stats: dict
+
+    :return: the label map (component id of each pixel) and the the associated BndBox object of this segmentation
+    :rtype: tuple (numpy.ndarray of int32, BndBox)
+
+    :UC: in_image must be of shape (height,width,3), tile_size > 0, overlap >= 0
+    """
+    if overlap is None:
+        # two passes of the smoothing mask
+        overlap = 2 * (len(make_fgauss(sigma)) - 1)
+
+    tiles = [(y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+             for y0 in range(0, height, tile_size) for x0 in range(0, width, tile_size)]
+
+    # edges read from each run at once, all runs together hold about the edges of one tile
+    chunk_size = max(1024, 4 * tile_size * tile_size // len(tiles))
+
+    u = DisjointSet(width * height)
+    threshold = np.full(shape=width * height, fill_value=get_threshold(1, k), dtype=float)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = [_tile_run(in_image, sigma, tile, overlap, height, width, os.path.join(tmp_dir, f"run_{num}.npy"))
+                for num, tile in enumerate(tiles)]
+
+        # Segment
+        num_merges = 0
+        for edges_a, edges_b, weights in _merge_runs(runs, chunk_size):
+            num_merges += merge_sorted_edges(u, edges_a, edges_b, weights, k, threshold=threshold)
+
+        # post process small components
+        num_small_merges = 0
+        for edges_a, edges_b, _ in _merge_runs(runs, chunk_size):
+            num_small_merges += merge_small_components(u, edges_a, edges_b, min_size)
+
+        # close the memory maps before removing their files
+        del runs
+
+    if stats is not None:
+        stats["tiles"] = len(tiles)
+        stats["merges"] = num_merges
+        stats["small_merges"] = num_small_merges
+
+    return _label_forest(u, height, width)
+
+def _tile_run(in_image: np.ndarray, sigma: float, tile: tuple, overlap: int, height: int, width: int, path: str) -> np.ndarray:
+    """
+    Build the edges starting from the pixels of the given tile, sort them by weight
+    then by building order of a full-image graph, and write them in the given file
+
+    :param in_image: The image data as array
+    :param sigma: value of gaussian filter to smooth the image
+    :param tile: first row, last row (excluded), first column, last column (excluded) of the tile
+    :param overlap: pixels of context around the tile
+    :param height: height of the image
+    :param width: width of the image
+    :param path: path of the run file
+    :type in_image: numpy.array
+    :type sigma: float
+    :type tile: tuple
+    :type overlap: int
+    :type height: int
+    :type width: int
+    :type path: str
+
+    :return: the sorted run, memory mapped from its file
+    :rtype: numpy.ndarray of RUN_DTYPE
+    """
+    y0, y1, x0, x1 = tile
+
+    # 2 more pixels so that edges leaving the tile and the diagonal boundary
+    # conditions of build_graph are the ones of the full image
+    margin = overlap + 2
+    wy0, wy1 = max(y0 - margin, 0), min(y1 + margin, height)
+    wx0, wx1 = max(x0 - margin, 0), min(x1 + margin, width)
+    window_width = wx1 - wx0
 
-    num_cc = u.num_sets()
-    output = np.zeros(shape=(height, width, 3))
+    smooth_window = smooth(in_image[wy0:wy1, wx0:wx1], sigma)
+    edges_a, edges_b, weights = build_graph(smooth_window[:, :, 0], smooth_window[:, :, 1], smooth_window[:, :, 2],
+                                            wy1 - wy0, window_width)
 
-    # pick random colors for each component
-    colors = np.zeros(shape=(height * width, 3))
-    for i in range(height * width):
-        colors[i, :] = random_rgb()
+    ay, ax = np.divmod(edges_a, window_width)
+    by, bx = np.divmod(edges_b, window_width)
+    ay += wy0
+    ax += wx0
+    in_tile = (ay >= y0) & (ay < y1) & (ax >= x0) & (ax < x1)
+
+    ay, ax, by, bx = ay[in_tile], ax[in_tile], by[in_tile] + wy0, bx[in_tile] + wx0
+    dy, dx = by - ay, bx - ax
+
+    run = np.empty(shape=ay.shape[0], dtype=RUN_DTYPE)
+    run["a"] = ay * width + ax
+    run["b"] = by * width + bx
+    run["w"] = weights[in_tile]
+    run["d"] = np.where(dy < 0, 3, dy + dx * dy)
+
+    run = run[np.lexsort((_run_order(run), run["w"]))]
+
+    np.save(path, run)
+    return np.load(path, mmap_mode="r")
+
+def _run_order(run: np.ndarray) -> np.ndarray:
+    """
+    Return the position of the given edges in the building order of the full-image graph
+    (pixel by pixel in row-major order, then by direction)
+
+    :param run: edges
+    :type run: numpy.ndarray of RUN_DTYPE
+
+    :return: building order key of each edge
+    :rtype: numpy.ndarray of int64
+    """
+    return run["a"].astype(np.int64) * 4 + run["d"]
+
+def _merge_runs(runs: list, chunk_size: int):
+    """
+    Stream the edges of the given sorted runs in global (weight, building order) order,
+    batch by batch, reading at most chunk_size edges of each run at once
+
+    :param runs: sorted runs of edges
+    :param chunk_size: maximum number of edges read from each run at once
+    :type runs: list of numpy.ndarray of RUN_DTYPE
+    :type chunk_size: int
+
+    :return: generator of the sorted edges of each batch
+    :rtype: generator of tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    position = [0] * len(runs)
+
+    while any(position[num] < run.shape[0] for num, run in enumerate(runs)):
+        heads = [run[position[num]:position[num] + chunk_size] for num, run in enumerate(runs)]
+
+        # every edge up to the smallest last edge of the runs which are not fully read
+        # comes before all the edges which are not read yet
+        bound = None
+        for num, run in enumerate(runs):
+            if position[num] + chunk_size < run.shape[0]:
+                last = (heads[num]["w"][-1], int(_run_order(heads[num][-1:])[0]))
+                bound = last if bound is None else min(bound, last)
+
+        batch = []
+        for num, head in enumerate(heads):
+            count = head.shape[0]
+            if bound is not None:
+                count = np.count_nonzero((head["w"] < bound[0]) | ((head["w"] == bound[0]) & (_run_order(head) <= bound[1])))
+            batch.append(np.asarray(head[:count]))
+            position[num] += count
+
+        batch = np.concatenate(batch)
+        batch = batch[np.lexsort((_run_order(batch), batch["w"]))]
+
+        yield np.ascontiguousarray(batch["a"]), np.ascontiguousarray(batch["b"]), np.ascontiguousarray(batch["w"])
+
+def _label_forest(u: DisjointSet, height: int, width: int) -> tuple:
+    """
+    Return the label map of the given segmentation forest and its bounding boxes
+
+    :param u: the segmentation forest
+    :param height: height of the image
+    :param width: width of the image
+    :type u: DisjointSet
+    :type height: int
+    :type width: int
+
+    :return: the label map (component id of each pixel) and the associated BndBox object
+    :rtype: tuple (numpy.ndarray of int32, BndBox)
+    """
+    # label of each pixel = id of its component
+    labels = u.roots().reshape(height, width)
 
     # bounding box
-    bb = BndBox(np.unique(u.elts[:,2]),width,height)
+    bb = BndBox.from_labels(labels)
+
+    return labels, bb
+
+def build_graph(red_band: np.ndarray, green_band: np.ndarray, blue_band: np.ndarray, height: int, width: int) -> tuple:
+    """
+    Build the 8-neighbour grid graph of the image with array slicing,
+    each pixel is linked to its right, down, down-right and up-right neighbours.
+
+    Edges are returned in the same order as the former per-pixel loop
+    (pixel by pixel in row-major order, then right, down, down-right, up-right)
+    and the down-right edges stop at height - 2 as before, so the segmentation
+    results do not change.
+
+    :param red_band: red channel
+    :param green_band: green channel
+    :param blue_band: blue channel
+    :param height: height of the image
+    :param width: width of the image
+    :type red_band: numpy.ndarray
+    :type green_band: numpy.ndarray
+    :type blue_band: numpy.ndarray
+    :type height: int
+    :type width: int
+
+    :return: the first end, the second end and the weight of each edge
+    :rtype: tuple (numpy.ndarray of int32, numpy.ndarray of int32, numpy.ndarray of float32)
 
-    for y in range(height):
-        for x in range(width):
-            pixel_id = y * width + x
+    :UC: the three bands must be of shape (height,width)
+    """
+    bands = (red_band, green_band, blue_band)
+    ids = np.arange(height * width, dtype=np.int32).reshape(height, width)
 
-            comp = u.find(pixel_id)
-            output[y, x, :] = colors[comp, :]
+    edges_a = np.zeros(shape=(height, width, 4), dtype=np.int32)
+    edges_b = np.zeros(shape=(height, width, 4), dtype=np.int32)
+    weights = np.zeros(shape=(height, width, 4), dtype=np.float32)
+    valid = np.zeros(shape=(height, width, 4), dtype=bool)
 
-            # check if actual pixel is an outline of his seg bndbox
-            bb.check_pixel(str(comp),pixel_id)
+    # (dy, dx, first row, last row) of each neighbour, columns always stop at width - 1
+    # except for the down neighbour
+    neighbours = [(0, 1, 0, height),
+                  (1, 0, 0, height - 1),
+                  (1, 1, 0, height - 2),
+                  (-1, 1, 1, height)]
 
-    return output, bb
+    for num, (dy, dx, y0, y1) in enumerate(neighbours):
+        if y1 <= y0:
+            continue
+        src = (slice(y0, y1), slice(0, width - dx))
+        dst = (slice(y0 + dy, y1 + dy), slice(dx, width))
 
-def segment_graph(num_vertices: int, num_edges: int, edges: np.ndarray, c: int) -> Universe:
+        edges_a[src + (num,)] = ids[src]
+        edges_b[src + (num,)] = ids[dst]
+        weights[src + (num,)] = _band_diff(bands, src, dst)
+        valid[src + (num,)] = True
+
+    valid = valid.ravel()
+
+    return edges_a.ravel()[valid], edges_b.ravel()[valid], weights.ravel()[valid]
+
+def sort_edges(edges_a: np.ndarray, edges_b: np.ndarray, weights: np.ndarray, levels=None, max_weight=None) -> tuple:
+    """
+    Sort the edges by non-decreasing weight, edges of same weight keep their building order.
+
+    If levels is given, the edges are sorted in linear time on their weight quantized
+    to this number of levels (cf. quantize_weights), so edges of the same level keep
+    their building order. The weights themselves are not modified, the threshold
+    rule of the merge stays exact.
+
+    :param edges_a: first end of each edge
+    :param edges_b: second end of each edge
+    :param weights: weight of each edge
+    :param levels: number of quantization levels, None to sort on the exact weights
+    :param max_weight: upper bound of the quantized weights, default the largest given weight (cf. quantize_weights)
+    :type edges_a: numpy.ndarray
+    :type edges_b: numpy.ndarray
+    :type weights: numpy.ndarray
+    :type levels: int
+    :type max_weight: float
+
+    :return: the sorted edges
+    :rtype: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+
+    :UC: 1 < levels <= 65536
+    """
+    if levels is None:
+        order = np.argsort(weights, kind="stable")
+    else:
+        # stable sort of 16-bit integers is a radix sort in numpy
+        order = np.argsort(quantize_weights(weights, levels, max_weight), kind="stable")
+    return edges_a[order], edges_b[order], weights[order]
+
+def quantize_weights(weights: np.ndarray, levels: int, max_weight=None) -> np.ndarray:
+    """
+    Quantize the given edge weights to the given number of levels of same width
+    between 0 and max_weight. The weights of a smoothed image are far below MAX_DIFF,
+    so the levels are spread by default over the observed weights, up to the largest one
+
+    :param weights: weight of each edge
+    :param levels: number of quantization levels
+    :param max_weight: upper bound of the weights, default the largest given weight
+                       (MAX_DIFF for the whole range of an 8-bit RGB image), larger weights get the last level
+    :type weights: numpy.ndarray
+    :type levels: int
+    :type max_weight: float
+
+    :return: the level of each weight
+    :rtype: numpy.ndarray of uint16
+
+    :UC: 1 < levels <= 65536
+    """
+    if max_weight is None:
+        max_weight = float(weights.max()) if weights.shape[0] > 0 else 0.0
+    if max_weight <= 0:
+        return np.zeros(shape=weights.shape, dtype=np.uint16)
+
+    quantized = np.floor(weights * np.float32(levels / max_weight))
+    return np.clip(quantized, 0, levels - 1).astype(np.uint16)
+
+def compare_quantized(in_image: np.ndarray, sigma: float, k: int, min_size: int, height: int, width: int, levels: int, max_weight=None) -> dict:
+    """
+    Perform the felzenszwalb segmentation with the exact and the quantized sort
+    of the edges to measure the accuracy/speed tradeoff of the given number of levels
+
+    :param in_image: The image data as array
+    :param sigma: value of gaussian filter to smooth the image
+    :param k: constant for threshold function
+    :param min_size:  minimum component size (enforced by post-processing stage)
+    :param height: height of the image to segment
+    :param width: width of the image to segment
+    :param levels: number of quantization levels
+    :param max_weight: upper bound of the quantized weights, default the largest weight of the image (cf. quantize_weights)
+    :type in_image: numpy.array
+    :type sigma: float
+    :type k: int
+    :type min_size: int
+    :type height: int
+    :type width: int
+    :type levels: int
+    :type max_weight: float
+
+    :return: sort time of both segmentations (sort_time, quantized_sort_time), their number of regions
+             (n_regions, quantized_n_regions) and the disagreement of their label maps (cf. label_disagreement)
+    :rtype: dict
+
+    :UC: in_image must be of shape (height,width,3), 1 < levels <= 65536
+    """
+    smooth_image = smooth(in_image, sigma)
+    edges = build_graph(smooth_image[:, :, 0], smooth_image[:, :, 1], smooth_image[:, :, 2], height, width)
+
+    result = {}
+    labels = {}
+    for key, n_levels in [("", None), ("quantized_", levels)]:
+        start_time = time.time()
+        sorted_edges = sort_edges(*edges, n_levels, max_weight)
+        result[key + "sort_time"] = time.time() - start_time
+
+        u = segment_graph(width * height, *sorted_edges, k)
+        merge_small_components(u, sorted_edges[0], sorted_edges[1], min_size)
+        labels[key] = u.roots()
+        result[key + "n_regions"] = u.num_sets()
+
+    result["disagreement"] = label_disagreement(labels["quantized_"], labels[""])
+
+    return result
+
+def label_disagreement(labels: np.ndarray, ref_labels: np.ndarray) -> float:
+    """
+    Return the fraction of pixels on which two label maps disagree: pixels of a region
+    outside the region of the other label map it overlaps the most,
+    taking the worst of both directions
+
+    :param labels: a label map
+    :param ref_labels: another label map of the same image
+    :type labels: numpy.ndarray
+    :type ref_labels: numpy.ndarray
+
+    :return: fraction of disagreeing pixels, 0 when the two partitions are the same
+    :rtype: float
+
+    :UC: labels.shape == ref_labels.shape
+    """
+    _, labels = np.unique(labels.ravel(), return_inverse=True)
+    _, ref_labels = np.unique(ref_labels.ravel(), return_inverse=True)
+
+    # number of pixels of each (region, ref region) pair
+    pairs, counts = np.unique(labels.astype(np.int64) * (ref_labels.max() + 1) + ref_labels, return_counts=True)
+    pair_labels, pair_ref_labels = np.divmod(pairs, ref_labels.max() + 1)
+
+    best = np.zeros(shape=labels.max() + 1, dtype=np.int64)
+    np.maximum.at(best, pair_labels, counts)
+    best_ref = np.zeros(shape=ref_labels.max() + 1, dtype=np.int64)
+    np.maximum.at(best_ref, pair_ref_labels, counts)
+
+    return 1 - min(best.sum(), best_ref.sum()) / labels.shape[0]
+
+def segment_graph(num_vertices: int, edges_a: np.ndarray, edges_b: np.ndarray, weights: np.ndarray, c: int) -> DisjointSet:
     """
     Returns a disjoint-set forest representing the segmentation
 
     :param num_vertices: number of vertices in graph
-    :param num_edges: number of edges in graph
-    :param edges: array of edges
+    :param edges_a: first end of each edge
+    :param edges_b: second end of each edge
+    :param weights: weight of each edge
     :param c: constant for threshold function
     :type num_vertices: int
-    :type num_edges: int
-    :type edges: 
+    :type edges_a: numpy.ndarray
+    :type edges_b: numpy.ndarray
+    :type weights: numpy.ndarray
     :type c: int
 
     :return: a disjoint-set forest representing the segmentation
-    :rtype: Universe
+    :rtype: DisjointSet
+
+    :UC: edges must be sorted by non-decreasing weight (cf. sort_edges)
     """
-    # sort edges by weight (3rd column)
-    edges[0:num_edges, :] = edges[edges[0:num_edges, 2].argsort()]
     # make a disjoint-set forest
-    u = Universe(num_vertices)
-    # init thresholds
-    threshold = np.zeros(shape=num_vertices, dtype=float)
-    for i in range(num_vertices):
-        threshold[i] = get_threshold(1, c)
-
-    # for each edge, in non-decreasing weight order...
-    for i in range(num_edges):
-        pedge = edges[i, :]
-
-        # components connected by this edge
-        a = u.find(pedge[0])
-        b = u.find(pedge[1])
-        if a != b:
-            if (pedge[2] <= threshold[a]) and (pedge[2] <= threshold[b]):
-                u.join(a, b)
-                a = u.find(a)
-                threshold[a] = pedge[2] + get_threshold(u.size(a), c)
+    u = DisjointSet(num_vertices)
+
+    # merge components along the edges in non-decreasing weight order
+    merge_sorted_edges(u, edges_a, edges_b, weights, c)
 
     return u
 
@@ -175,19 +628,22 @@ def square(value):
     return value * value
 
 
-# randomly creates RGB
-def random_rgb():
+def colorize(labels: np.ndarray, seed=None) -> np.ndarray:
     """
-    Return a random 3-RBG colors channel
+    Return a picture of the given label map, each region is painted
+    with a random color picked once per region
 
-    :return: a 3-RBG colors channel
-    :rtype: numpy.array
+    :param labels: label map of a segmentation
+    :param seed: seed of the random colors
+    :type labels: numpy.ndarray
+    :type seed: int
+
+    :return: the colored segmentation
+    :rtype: numpy.ndarray of uint8 of shape (height,width,3)
     """
-    rgb = np.zeros(3, dtype=int)
-    rgb[0] = random.randint(0, 255)
-    rgb[1] = random.randint(0, 255)
-    rgb[2] = random.randint(0, 255)
-    return rgb
+    comps, index = np.unique(labels, return_inverse=True)
+    colors = np.random.default_rng(seed).integers(0, 256, size=(comps.shape[0], 3), dtype=np.uint8)
+    return colors[index.reshape(labels.shape)]
 
 
 # dissimilarity measure between pixels
@@ -209,4 +665,25 @@ def diff(red_band: np.ndarray, green_band: np.ndarray, blue_band: np.ndarray, x1
     result = math.sqrt(
         square(red_band[y1, x1] - red_band[y2, x2]) + square(green_band[y1, x1] - green_band[y2, x2]) + square(
             blue_band[y1, x1] - blue_band[y2, x2]))
-    return result
\ No newline at end of file
+    return result
+
+
+def _band_diff(bands: tuple, src: tuple, dst: tuple) -> np.ndarray:
+    """
+    Vectorized version of diff, perform the dissimilarity measure between
+    the pixels selected by src and the pixels selected by dst
+
+    :param bands: red, green and blue channels
+    :param src: slices selecting the first pixels
+    :param dst: slices selecting the second pixels
+    :type bands: tuple
+    :type src: tuple
+    :type dst: tuple
+
+    :return: dissimilarity measure between each pair of pixels
+    :rtype: numpy.ndarray
+    """
+    result = np.zeros(shape=bands[0][src].shape, dtype=np.float32)
+    for band in bands:
+        result += square(band[src].astype(np.float32) - band[dst].astype(np.float32))
+    return np.sqrt(result)
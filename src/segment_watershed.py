@@ -12,18 +12,111 @@ Segment Watershed Module
 
 """
 
+import os
+import threading
 import numpy as np
 from cv2 import ximgproc
 import higra as hg
 
 from bndbox import * 
+from gradient_cache import model_identity, sed_cache_dir
+
+# structured edge detection (SED) forest model
+SED_MODEL_NAME = "opencv_sed_model.yml.gz"
+SED_MODEL_URL = "https://github.com/higra/Higra-Notebooks/raw/master/resources/" + SED_MODEL_NAME
+# environment variable giving the model file
+SED_MODEL_ENV = "SED_MODEL_FILE"
+
+# watershed hierarchies which can be computed from the same edge weighted graph
+WATERSHED_HIERARCHIES = {
+    "area": hg.watershed_hierarchy_by_area,
+    "volume": hg.watershed_hierarchy_by_volume,
+    "dynamics": hg.watershed_hierarchy_by_dynamics,
+}
+
+# one detector per model file, shared by every call and thread of the process
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+def get_sed_model_file(model_path=None) -> str:
+    """
+    Return the path of the SED model file, looked up in this order : the given path,
+    the SED_MODEL_FILE environment variable, SED_MODEL_NAME in the cache directory
+    (cf. gradient_cache.sed_cache_dir) and in the resources directory of the project.
+    Nothing is downloaded
+
+    :param model_path: path of the model file
+    :type model_path: str
 
-try:
-    from utils import * # imshow, locate_resource, get_sed_model_file
-except: # we are probably running from the cloud, try to fetch utils functions from URL
-    import urllib.request as request; exec(request.urlopen('https://github.com/higra/Higra-Notebooks/raw/master/utils.py').read(), globals())
+    :return: path of the model file
+    :rtype: str
 
-def segment_watershed(in_image: np.array,height: int,width: int,n_comp=9) -> tuple:
+    :raise FileNotFoundError: if the model file is not found
+    """
+    if model_path is None:
+        model_path = os.environ.get(SED_MODEL_ENV)
+
+    if model_path is not None:
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"SED model file not found : {model_path}")
+        return model_path
+
+    cache_dir = sed_cache_dir()
+    resources_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources"))
+
+    for directory in (cache_dir, resources_dir):
+        path = os.path.join(directory, SED_MODEL_NAME)
+        if os.path.isfile(path):
+            return path
+
+    raise FileNotFoundError(f"SED model file {SED_MODEL_NAME} not found in {cache_dir} nor in {resources_dir}, "
+                            f"download it once with :\n\n\t$ mkdir -p {cache_dir} && wget -O {os.path.join(cache_dir, SED_MODEL_NAME)} {SED_MODEL_URL}\n\n"
+                            f"or give its path with the {SED_MODEL_ENV} environment variable")
+
+def get_sed_detector(model_path=None):
+    """
+    Return the structured edge detector of the given model file (cf. get_sed_model_file),
+    the model is loaded once per process at the first call and the detector is then
+    shared by every call and thread
+
+    :param model_path: path of the model file
+    :type model_path: str
+
+    :return: the structured edge detector
+    :rtype: cv2.ximgproc.StructuredEdgeDetection
+
+    :raise FileNotFoundError: if the model file is not found
+    """
+    model_path = os.path.realpath(get_sed_model_file(model_path))
+
+    with _detectors_lock:
+        if model_path not in _detectors:
+            _detectors[model_path] = ximgproc.createStructuredEdgeDetection(model_path)
+        return _detectors[model_path]
+
+def sed_gradient(in_image: np.array,model_path=None,cache=None) -> np.ndarray:
+    """
+    Return the gradient image (structured edges) of the given image, read from the given cache
+    if it was already computed with the same model, in which case the detector is not even loaded
+
+    :param in_image: The image data as array
+    :param model_path: path of the SED model file (cf. get_sed_model_file)
+    :param cache: cache of gradient images
+    :type in_image: numpy.array
+    :type model_path: str
+    :type cache: GradientCache
+
+    :return: the gradient image
+    :rtype: numpy.ndarray
+    """
+    if cache is None:
+        return get_sed_detector(model_path).detectEdges(in_image)
+
+    model_path = get_sed_model_file(model_path)
+    return cache.get_or_compute(in_image, model_identity(model_path),
+                                lambda: get_sed_detector(model_path).detectEdges(in_image))
+
+def segment_watershed(in_image: np.array,height: int,width: int,n_comp=9,model_path=None,cache=None) -> tuple:
     """
     Perform a watershed segmentation on the given image and
     retain exactly the given number of larger regions to retain in the hierachy
@@ -34,45 +127,126 @@ def segment_watershed(in_image: np.array,height: int,width: int,n_comp=9) -> tup
     :param height: the height of in_image
     :param width: the width of in_image
     :param n_comp: number of larger regions to retain in the hierachy
+    :param model_path: path of the SED model file (cf. get_sed_model_file)
+    :param cache: if given, cache of gradient images (cf. sed_gradient)
     :type in_image: numpy.array
     :type height: int
     :type width: int
     :type n_comp: int
+    :type model_path: str
+    :type cache: GradientCache
 
     :return: the array indicating which region each pixel belongs to and the associated BndBox object of this segmentation
     :rtype: tuple (numpy.ndarray, BndBox)
     """
+    return segment_watershed_cuts(in_image,height,width,[n_comp],model_path=model_path,cache=cache)[0]
+
+def segment_watershed_cuts(in_image: np.array,height: int,width: int,n_comps: list,model_path=None,cache=None,hierarchy="area") -> list:
+    """
+    Perform a watershed segmentation on the given image and retain, for each given number,
+    exactly this number of larger regions in the hierarchy (cf. segment_watershed).
+    Gradient, hierarchy and saliency are computed once, each segmentation is
+    a horizontal cut of the same hierarchy
+
+    :param in_image: The image data as array
+    :param height: the height of in_image
+    :param width: the width of in_image
+    :param n_comps: numbers of larger regions to retain in the hierachy
+    :param model_path: path of the SED model file (cf. get_sed_model_file)
+    :param cache: if given, cache of gradient images (cf. sed_gradient)
+    :param hierarchy: watershed hierarchy, a key of WATERSHED_HIERARCHIES
+    :type in_image: numpy.array
+    :type height: int
+    :type width: int
+    :type n_comps: list of int
+    :type model_path: str
+    :type cache: GradientCache
+    :type hierarchy: str
+
+    :return: the label map and the BndBox object of the segmentation of each given number of regions
+    :rtype: list of tuple (numpy.ndarray, BndBox)
+    """
+    return segment_watershed_hierarchies(in_image,height,width,n_comps,hierarchies=[hierarchy],
+                                         model_path=model_path,cache=cache)[hierarchy]
+
+def segment_watershed_hierarchies(in_image: np.array,height: int,width: int,n_comps: list,hierarchies=("area","volume","dynamics"),model_path=None,cache=None) -> dict:
+    """
+    Perform a watershed segmentation of the given image with each given watershed hierarchy
+    and cut each hierarchy for each given number of regions (cf. segment_watershed_cuts).
+    Gradient, 4-adjacency graph and edge weights are computed once for every hierarchy
+
+    :param in_image: The image data as array
+    :param height: the height of in_image
+    :param width: the width of in_image
+    :param n_comps: numbers of larger regions to retain in each hierachy
+    :param hierarchies: watershed hierarchies, keys of WATERSHED_HIERARCHIES
+    :param model_path: path of the SED model file (cf. get_sed_model_file)
+    :param cache: if given, cache of gradient images (cf. sed_gradient)
+    :type in_image: numpy.array
+    :type height: int
+    :type width: int
+    :type n_comps: list of int
+    :type hierarchies: list of str
+    :type model_path: str
+    :type cache: GradientCache
+
+    :return: for each hierarchy, the label map and the BndBox object of the segmentation of each given number of regions
+    :rtype: dict of list of tuple (numpy.ndarray, BndBox)
+
+    :UC: every hierarchy must be a key of WATERSHED_HIERARCHIES
+    """
+    assert(all(hierarchy in WATERSHED_HIERARCHIES for hierarchy in hierarchies))
+
     # get gradient image 
-    detector = ximgproc.createStructuredEdgeDetection(get_sed_model_file())
-    gradient_image = detector.detectEdges(in_image)
+    gradient_image = sed_gradient(in_image,model_path=model_path,cache=cache)
 
     # contruct an edge weighted graph, and transfer gradient to edge weights
     graph = hg.get_4_adjacency_graph(in_image.shape[:2])
     edge_weights = hg.weight_graph(graph, gradient_image, hg.WeightFunction.mean)
 
-    # watershed hierarchy by area
-    tree, altitudes = hg.watershed_hierarchy_by_area(graph, edge_weights)
-    #output = hg.graph_4_adjacency_2_khalimsky(graph, hg.saliency(tree, altitudes))**0.5
+    results = {}
+    for hierarchy in hierarchies:
+        tree, altitudes = WATERSHED_HIERARCHIES[hierarchy](graph, edge_weights)
+        results[hierarchy] = horizontal_cuts(tree,altitudes,n_comps,(height,width))
 
-    # saillence graph
-    graph_saliency = hg.saliency(tree, altitudes)
+    return results
 
-    # get all index of pixel which belong to comp which are < to the n_comp th highest comp
-    if n_comp < len(np.unique(graph_saliency)):
-        index = graph_saliency < np.unique(graph_saliency)[-n_comp]
-
-        # replace all index by a weight of 0 (= ignoring them)
-        graph_saliency[index] = 0
+def horizontal_cuts(tree,altitudes: np.ndarray,n_comps: list,shape: tuple) -> list:
+    """
+    Cut the given hierarchy so as to retain, for each given number, exactly this number of larger regions,
+    the sorted saliency levels are computed once.
+
+    The edges whose saliency is below the n_comp th highest level are ignored (cf. segment_watershed),
+    which is the horizontal cut of the hierarchy at the level just below. The regions are numbered
+    from 1 in the order of their first pixel, as hg.labelisation_watershed does
+
+    :param tree: the hierarchy
+    :param altitudes: altitude of each node of the hierarchy
+    :param n_comps: numbers of larger regions to retain in the hierachy
+    :param shape: height and width of the image
+    :type tree: higra.Tree
+    :type altitudes: numpy.ndarray
+    :type n_comps: list of int
+    :type shape: tuple
+
+    :return: the label map and the BndBox object of each cut
+    :rtype: list of tuple (numpy.ndarray, BndBox)
+    """
+    # sorted saliency levels
+    levels = np.unique(hg.saliency(tree, altitudes))
+    explorer = hg.HorizontalCutExplorer(tree, altitudes)
 
-    # get pixel label (= comp) from adj graph and saliency graph
-    label_watershed = hg.labelisation_watershed(graph,graph_saliency) 
+    results = []
+    for n_comp in n_comps:
+        cut = explorer.horizontal_cut_from_altitude(levels[max(len(levels) - n_comp - 1, 0)])
+        node, first, index = np.unique(cut.labelisation_leaves(tree), return_index=True, return_inverse=True)
 
-    # bindingbox
-    bb = BndBox(np.unique(label_watershed),width,height)
+        # number the regions in the order of their first pixel
+        rank = np.empty(shape=node.shape[0], dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(1, node.shape[0] + 1)
+        label_watershed = rank[index].reshape(shape)
 
-    # calculate bb from watershed seg
-    for y in range(height):
-        for x in range(width):
-            bb.check_pixel(str(label_watershed[y][x]),y*width+x)
+        # bindingbox calculated from watershed seg
+        results.append((label_watershed, BndBox.from_labels(label_watershed)))
 
-    return label_watershed, bb
+    return results
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`Selective Search` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Selective Search Module
+
+Hierarchical grouping of the regions of a segmentation
+
+:doc: <http://www.huppelen.nl/publications/selectiveSearchDraft.pdf>
+
+"""
+
+import heapq
+import numpy as np
+
+from bndbox import *
+from rag import region_adjacency_graph
+
+# number of bins of the colour histogram of each channel
+COLOUR_BINS = 25
+
+def selective_search(in_image: np.ndarray, labels: np.ndarray, similarities=("colour", "size", "fill")) -> BndBox:
+    """
+    Perform the hierarchical grouping of Selective Search starting from the regions
+    of the given label map (felzenszwalb or watershed segmentation): the two most similar
+    adjacent regions are merged until a single region remains.
+
+    Regions are taken from a priority heap, the colour histogram, size and box
+    of a merged region are computed from the ones of its two regions
+    in O(bins) instead of from its pixels.
+
+    <http://www.huppelen.nl/publications/selectiveSearchDraft.pdf>
+
+    :param in_image: The image data as array, uint8 or float in [0,1]
+    :param labels: label map of the segmentation
+    :param similarities: similarity measures to sum, among colour, size and fill
+    :type in_image: numpy.ndarray
+    :type labels: numpy.ndarray
+    :type similarities: tuple
+
+    :return: the BndBox object of every region of the hierarchy, the initial regions are numbered
+             from 0 in the order of their label and each merged region takes the next number
+    :rtype: BndBox
+
+    :UC: in_image must be of shape (height,width,3) and labels of shape (height,width)
+    """
+    height, width = labels.shape
+    n_pixels = height * width
+    label, boxes, count = extract_bndbox(labels)
+    n_regions = label.shape[0]
+    _, index = np.unique(labels.ravel(), return_inverse=True)
+    rag = region_adjacency_graph(labels)
+
+    # a merge creates one region, the hierarchy has 2 * n_regions - 1 regions
+    n_total = 2 * n_regions - 1
+    hist = np.zeros(shape=(n_total, 3 * COLOUR_BINS), dtype=np.float32)
+    hist[:n_regions] = _colour_histograms(in_image, index, n_regions)
+    size = np.zeros(shape=n_total, dtype=np.int64)
+    size[:n_regions] = count
+    region_boxes = np.zeros(shape=(n_total, 4), dtype=np.int32)
+    region_boxes[:n_regions] = boxes
+
+    def similarity(i: int, j: int) -> float:
+        result = 0
+        if "colour" in similarities:
+            result += np.minimum(hist[i], hist[j]).sum()
+        if "size" in similarities:
+            result += 1 - (size[i] + size[j]) / n_pixels
+        if "fill" in similarities:
+            xmin, ymin = min(region_boxes[i, 0], region_boxes[j, 0]), min(region_boxes[i, 1], region_boxes[j, 1])
+            xmax, ymax = max(region_boxes[i, 2], region_boxes[j, 2]), max(region_boxes[i, 3], region_boxes[j, 3])
+            result += 1 - ((xmax - xmin + 1) * (ymax - ymin + 1) - size[i] - size[j]) / n_pixels
+        return float(result)
+
+    neighbours = [set(rag.neighbours(i).tolist()) for i in range(n_regions)] + [set() for _ in range(n_regions, n_total)]
+
+    heap = [(-similarity(i, j), i, j) for i in range(n_regions) for j in neighbours[i] if i < j]
+    heapq.heapify(heap)
+    alive = np.zeros(shape=n_total, dtype=bool)
+    alive[:n_regions] = True
+
+    new = n_regions
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        if not (alive[i] and alive[j]):
+            continue
+
+        # merged region
+        size[new] = size[i] + size[j]
+        hist[new] = (hist[i] * size[i] + hist[j] * size[j]) / size[new]
+        region_boxes[new, :2] = np.minimum(region_boxes[i, :2], region_boxes[j, :2])
+        region_boxes[new, 2:] = np.maximum(region_boxes[i, 2:], region_boxes[j, 2:])
+        alive[i] = alive[j] = False
+        alive[new] = True
+
+        neighbours[new] = (neighbours[i] | neighbours[j]) - {i, j}
+        for n in neighbours[new]:
+            neighbours[n] -= {i, j}
+            neighbours[n].add(new)
+            heapq.heappush(heap, (-similarity(new, n), n, new))
+        neighbours[i] = neighbours[j] = set()
+
+        new += 1
+
+    return BndBox(np.arange(new), width, height, boxes=region_boxes[:new], count=size[:new])
+
+def _colour_histograms(in_image: np.ndarray, index: np.ndarray, n_regions: int) -> np.ndarray:
+    """
+    Return the L1-normalized colour histogram of each region, COLOUR_BINS bins per channel
+
+    :param in_image: The image data as array, uint8 or float in [0,1]
+    :param index: region number (from 0) of each pixel
+    :param n_regions: number of regions
+    :type in_image: numpy.ndarray
+    :type index: numpy.ndarray
+    :type n_regions: int
+
+    :return: the colour histogram of each region
+    :rtype: numpy.ndarray of shape (n_regions, 3 * COLOUR_BINS)
+    """
+    if np.issubdtype(in_image.dtype, np.floating):
+        in_image = np.clip(in_image * 255, 0, 255)
+    bins = (in_image.astype(np.int64) * COLOUR_BINS) // 256
+
+    hist = np.empty(shape=(n_regions, 3 * COLOUR_BINS), dtype=np.float32)
+    for channel in range(3):
+        key = index * COLOUR_BINS + bins[:, :, channel].ravel()
+        hist[:, channel * COLOUR_BINS:(channel + 1) * COLOUR_BINS] = np.bincount(key, minlength=n_regions * COLOUR_BINS).reshape(n_regions, COLOUR_BINS)
+
+    return hist / hist.sum(axis=1, keepdims=True)
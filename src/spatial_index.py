@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+:mod:`spatial_index` module
+:author: Pather Stevenson - Faculté des Sciences et Technologies - Univ. Lille <http://portail.fil.univ-lille1.fr>_
+:date: May 2023
+
+Spatial Index Module
+
+Uniform grid over bounding boxes, built once per image, to get only
+the boxes which can intersect a given box
+
+"""
+
+import numpy as np
+
+class GridIndex:
+    """
+    Create a GridIndex object which bins boxes into the cells of a uniform grid
+    (compressed as cell pointers and box ids) to answer intersection queries
+    """
+    def __init__(self, boxes: np.ndarray, cell_size=None, max_cells=64):
+        """
+        Create a GridIndex object which bins boxes into the cells of a uniform grid
+        (compressed as cell pointers and box ids) to answer intersection queries
+
+        :param boxes: xmin, ymin, xmax, ymax of each box
+        :param cell_size: side of the cells in pixels, by default the median side of the boxes
+        :param max_cells: boxes covering more cells are not binned but returned by every query
+        :type boxes: numpy.ndarray of shape (n,4)
+        :type cell_size: int
+        :type max_cells: int
+
+        :UC: boxes coordinates >= 0
+        """
+        boxes = np.asarray(boxes, dtype=np.int64)
+        self.n_boxes = boxes.shape[0]
+
+        if cell_size is None:
+            sides = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) if boxes.shape[0] else np.ones(1)
+            cell_size = max(8, int(np.median(sides)))
+        self.cell_size = cell_size
+
+        # cells covered by each box
+        cx0, cy0 = boxes[:, 0] // cell_size, boxes[:, 1] // cell_size
+        nx = boxes[:, 2] // cell_size - cx0 + 1
+        ny = boxes[:, 3] // cell_size - cy0 + 1
+        n_cells = nx * ny
+        # first cell of each box, a pair (query, box) is only reported in the first cell they share
+        self.box_cx0, self.box_cy0 = cx0, cy0
+
+        self.grid_w = int((boxes[:, 2].max() // cell_size) + 1) if boxes.shape[0] else 1
+        self.grid_h = int((boxes[:, 3].max() // cell_size) + 1) if boxes.shape[0] else 1
+
+        binned = n_cells <= max_cells
+        self.large = np.flatnonzero(~binned)
+
+        # one (cell, box) pair for each cell covered by each binned box
+        box_ids = np.flatnonzero(binned)
+        pair_box = np.repeat(box_ids, n_cells[box_ids])
+        start = np.cumsum(n_cells[box_ids]) - n_cells[box_ids]
+        rel = np.arange(pair_box.shape[0]) - np.repeat(start, n_cells[box_ids])
+        dy, dx = np.divmod(rel, nx[pair_box])
+        pair_cell = (cy0[pair_box] + dy) * self.grid_w + cx0[pair_box] + dx
+
+        order = np.argsort(pair_cell, kind="stable")
+        self.box_ids = pair_box[order]
+        self.cell_ptr = np.concatenate(([0], np.cumsum(np.bincount(pair_cell, minlength=self.grid_w * self.grid_h))))
+
+    def query(self, box) -> np.ndarray:
+        """
+        Return the boxes which can intersect the given box (a superset of
+        the boxes which actually intersect it)
+
+        :param box: xmin, ymin, xmax, ymax of the query box
+        :type box: tuple or numpy.ndarray
+
+        :return: sorted indices of the candidate boxes
+        :rtype: numpy.ndarray
+
+        :UC: None
+        """
+        return np.sort(self.query_pairs(np.asarray(box)[None, :])[1])
+
+    def query_pairs(self, query_boxes: np.ndarray) -> tuple:
+        """
+        Return the pairs (query box, box) which can intersect for all the given query boxes at once
+        (a superset of the pairs which actually intersect), each pair once
+
+        :param query_boxes: xmin, ymin, xmax, ymax of each query box
+        :type query_boxes: numpy.ndarray of shape (m,4)
+
+        :return: index of the query box and index of the candidate box of each pair, sorted by query
+        :rtype: tuple (numpy.ndarray, numpy.ndarray)
+
+        :UC: None
+        """
+        query_boxes = np.asarray(query_boxes, dtype=np.int64).reshape(-1, 4)
+        n_queries = query_boxes.shape[0]
+
+        # cells covered by each query box, clipped to the grid
+        cx0 = np.maximum(query_boxes[:, 0] // self.cell_size, 0)
+        cy0 = np.maximum(query_boxes[:, 1] // self.cell_size, 0)
+        nx = np.maximum(np.minimum(query_boxes[:, 2] // self.cell_size, self.grid_w - 1) - cx0 + 1, 0)
+        ny = np.maximum(np.minimum(query_boxes[:, 3] // self.cell_size, self.grid_h - 1) - cy0 + 1, 0)
+        n_cells = nx * ny
+
+        # one (query, cell) pair for each cell covered by each query box
+        pair_query = np.repeat(np.arange(n_queries), n_cells)
+        rel = np.arange(pair_query.shape[0]) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        dy, dx = np.divmod(rel, nx[pair_query])
+        cells = (cy0[pair_query] + dy) * self.grid_w + cx0[pair_query] + dx
+
+        # concatenate the box ids of all the cells
+        start, end = self.cell_ptr[cells], self.cell_ptr[cells + 1]
+        length = end - start
+        rel = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length)
+        queries = np.repeat(pair_query, length)
+        candidates = self.box_ids[np.repeat(start, length) + rel]
+
+        # a box binned in several cells of a query is kept in the first cell they share only
+        cell_y, cell_x = np.divmod(np.repeat(cells, length), self.grid_w)
+        first = ((cell_x == np.maximum(self.box_cx0[candidates], cx0[queries]))
+                 & (cell_y == np.maximum(self.box_cy0[candidates], cy0[queries])))
+
+        queries = np.concatenate((queries[first], np.repeat(np.arange(n_queries), self.large.shape[0])))
+        candidates = np.concatenate((candidates[first], np.tile(self.large, n_queries)))
+
+        order = np.argsort(queries, kind="stable")
+        return queries[order], candidates[order]